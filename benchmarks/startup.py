@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(cold):
+    # One cold start, timed from inside the process
+    start = time.perf_counter()
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    from modules.assets import CACHE_DIR
+
+    # Only the atlas pages, the converted sound effect caches stay
+    if cold:
+        for path in glob.glob(os.path.join(CACHE_DIR, "*.atlas")):
+            os.remove(path)
+
+    from game import Game
+
+    imported = time.perf_counter()
+    game = Game(headless=True)
+    constructed = time.perf_counter()
+    game.step()
+    game.render()
+    first_frame = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "import_ms": (imported - start) * 1000,
+                "init_ms": (constructed - imported) * 1000,
+                "first_frame_ms": (first_frame - constructed) * 1000,
+                "time_to_first_frame_ms": (first_frame - start) * 1000,
+                "cache_hits": game.asset_loader.hits,
+                "cache_misses": game.asset_loader.misses,
+            }
+        )
+    )
+
+
+def run(runs, cold):
+    results = []
+    for i in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"] + (["--cold"] if cold else []), capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process_ms"] = (time.perf_counter() - start) * 1000
+        results.append(result)
+
+    summary = {"runs": runs, "cold": cold}
+    for key in ["import_ms", "init_ms", "first_frame_ms", "time_to_first_frame_ms", "process_ms"]:
+        values = [result[key] for result in results]
+        summary[key] = {"median": statistics.median(values), "min": min(values), "max": max(values)}
+    summary["cache_hits"] = results[-1]["cache_hits"]
+    summary["cache_misses"] = results[-1]["cache_misses"]
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time from process start to the first rendered frame")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="delete the atlas cache before every run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.cold)
+    else:
+        print(json.dumps(run(args.runs, args.cold), indent=2))
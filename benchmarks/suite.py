@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+import pygame
+from game import Game, scripted_inputs
+from modules.tilemap import Tilemap
+from modules.entities import PhysicsEntity
+from modules.particles import ParticleSystem
+from modules.sparks import SparkSystem
+from modules.outline import Outline
+
+MAPS = ["data/maps/0.json", "data/maps/1.json", "data/maps/2.json"]
+# Shipped maps repeated this many times across and down, for scaling
+SCALES = [8]
+
+PERCENTILES = [50, 99]
+
+
+def measure(fn, iterations, ops=1, warmup=5):
+    # Times each call of fn, which does ops units of work
+    for i in range(warmup):
+        fn(i)
+
+    times = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        times.append((time.perf_counter() - start) * 1000)
+
+    times.sort()
+    stats = {
+        "iterations": iterations,
+        "ops": ops,
+        "mean_ms": sum(times) / iterations,
+        "ops_per_s": ops * iterations / (sum(times) / 1000),
+    }
+    for pct in PERCENTILES:
+        stats["p" + str(pct) + "_ms"] = times[min(iterations - 1, int(iterations * pct / 100))]
+    return stats
+
+
+def load_map(game, path, scale=1):
+    tilemap = Tilemap(game, tile_size=16)
+    tilemap.load(path)
+    # Spawners are pulled out on level load and never drawn in game
+    tilemap.extract([("spawners", 0), ("spawners", 1)])
+    if scale == 1:
+        return tilemap
+
+    # Repeat the map scale x scale times, one map width or height apart
+    tiles = list(tilemap.grid_tiles())
+    offgrid = list(tilemap.offgrid_tiles)
+    xs = [x for x, y, t_id, variant in tiles]
+    ys = [y for x, y, t_id, variant in tiles]
+    span = (max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+    for sx in range(scale):
+        for sy in range(scale):
+            if not sx and not sy:
+                continue
+            for x, y, t_id, variant in tiles:
+                tilemap.set_tile((x + sx * span[0], y + sy * span[1]), tilemap.tile_types[t_id], variant)
+            for tile in offgrid:
+                pos = [tile["pos"][0] + sx * span[0] * tilemap.tile_size, tile["pos"][1] + sy * span[1] * tilemap.tile_size]
+                tilemap.add_offgrid({"type": tile["type"], "variant": tile["variant"], "pos": pos})
+
+    return tilemap
+
+
+def map_bounds(tilemap):
+    xs = [x for x, y, t_id, variant in tilemap.grid_tiles()]
+    ys = [y for x, y, t_id, variant in tilemap.grid_tiles()]
+    return (min(xs) * tilemap.tile_size, min(ys) * tilemap.tile_size, (max(xs) + 1) * tilemap.tile_size, (max(ys) + 1) * tilemap.tile_size)
+
+
+def bench_map(game, name, tilemap, iterations):
+    results = {}
+    bounds = map_bounds(tilemap)
+    view = game.display.get_size()
+    rng = random.Random(0)
+    points = [(rng.uniform(bounds[0], bounds[2]), rng.uniform(bounds[1], bounds[3])) for i in range(1000)]
+
+    # Camera pans a full lap around the map, so chunks get baked as well as reused
+    def render(i):
+        t = i / iterations * math.pi * 2
+        offset = (
+            int((bounds[0] + bounds[2] - view[0]) / 2 + math.cos(t) * (bounds[2] - bounds[0]) / 2),
+            int((bounds[1] + bounds[3] - view[1]) / 2 + math.sin(t) * (bounds[3] - bounds[1]) / 2),
+        )
+        game.display.fill((0, 0, 0, 0))
+        tilemap.render(game.display, offset=offset)
+
+    results["tilemap/render/" + name] = measure(render, iterations)
+
+    def tiles_around(i):
+        for pos in points:
+            tilemap.tiles_around(pos)
+
+    results["tilemap/tiles_around/" + name] = measure(tiles_around, max(1, iterations // 10), ops=len(points))
+
+    # sweep() is the collision query PhysicsEntity.update makes once per moving axis
+    def sweep(i):
+        for pos in points:
+            tilemap.sweep(pos, (8, 15), 3, 0)
+            tilemap.sweep(pos, (8, 15), 3, 1)
+
+    results["physics/sweep/" + name] = measure(sweep, max(1, iterations // 10), ops=len(points) * 2)
+
+    entities = [PhysicsEntity(game, "enemy", pos, (8, 15)) for pos in points[:200]]
+
+    def entity_update(i):
+        for entity in entities:
+            entity.update(tilemap, (1 if i % 120 < 60 else -1, 0))
+
+    results["physics/entity_update/" + name] = measure(entity_update, iterations, ops=len(entities))
+    return results
+
+
+def bench_effects(game, iterations, count):
+    results = {}
+    rng = random.Random(0)
+    display = game.display
+
+    particles = ParticleSystem(game)
+
+    def particle_frame(i):
+        # Topped up every frame so the load stays at count
+        while len(particles) < count:
+            particles.add(
+                rng.choice(["leaf", "particle"]),
+                (rng.uniform(0, 320), rng.uniform(0, 240)),
+                velocity=[rng.uniform(-1, 1), rng.uniform(-1, 1)],
+                frame=rng.randint(0, 7),
+            )
+        particles.update()
+        particles.render(display)
+
+    results["effects/particles/" + str(count)] = measure(particle_frame, iterations, ops=count)
+
+    sparks = SparkSystem()
+
+    def spark_frame(i):
+        while len(sparks) < count:
+            sparks.add((rng.uniform(0, 320), rng.uniform(0, 240)), rng.random() * math.pi * 2, 2 + rng.random() * 3)
+        sparks.update()
+        sparks.render(display)
+
+    results["effects/sparks/" + str(count)] = measure(spark_frame, iterations, ops=count)
+
+    # Two alternating scenes, so the outline cache never gets to skip the pass
+    outline = Outline(display.get_size())
+    scenes = []
+    for k in range(2):
+        scene = pygame.Surface(display.get_size(), pygame.SRCALPHA)
+        game.tilemap.render(scene, offset=(k * 16, 0))
+        scenes.append(scene)
+
+    def outline_pass(i):
+        outline.render(scenes[i % 2], game.display_2, game.assets["background"])
+
+    results["render/outline"] = measure(outline_pass, iterations)
+    return results
+
+
+def bench_frames(iterations, enemies, particles):
+    results = {}
+    for enemy_count, particle_count in [(0, 0), (enemies, particles)]:
+        game = Game(headless=True, seed=0)
+        spawns = list(game.level_template.enemy_spawns)
+        for i in range(enemy_count):
+            game.enemies.add(spawns[i % len(spawns)])
+        inputs = iter(scripted_inputs(iterations + 10))
+        rng = random.Random(0)
+
+        def frame(i):
+            while len(game.particles) < particle_count:
+                game.particles.add("particle", (game.scroll[0] + rng.uniform(0, 320), game.scroll[1] + rng.uniform(0, 240)), frame=rng.randint(0, 7))
+            game.step(next(inputs))
+            game.render()
+
+        name = "frame/level0" + ("+" + str(enemy_count) + "enemies+" + str(particle_count) + "particles" if enemy_count or particle_count else "")
+        results[name] = measure(frame, iterations)
+
+    return results
+
+
+def run(args):
+    game = Game(headless=True, seed=0)
+    results = {}
+
+    for path in MAPS + args.map:
+        name = os.path.splitext(os.path.basename(path))[0]
+        results.update(bench_map(game, name, load_map(game, path), args.iterations))
+        if path in MAPS:
+            for scale in SCALES:
+                results.update(bench_map(game, name + "x" + str(scale), load_map(game, path, scale), args.iterations))
+
+    results.update(bench_effects(game, args.iterations, args.particles))
+    results.update(bench_frames(args.iterations, args.enemies, args.particles))
+
+    if args.filter:
+        results = {name: stats for name, stats in results.items() if args.filter in name}
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    # p50 of every benchmark against the baseline's, worse than threshold counts as a regression
+    regressions = []
+    for name, stats in sorted(report["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]["p50_ms"]
+        ratio = stats["p50_ms"] / old if old else 1
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(name.ljust(60) + str(round(old, 3)).rjust(10) + " -> " + str(round(stats["p50_ms"], 3)).ljust(10) + str(round(ratio, 2)) + "x" + flag, file=sys.stderr)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless throughput and p50/p99 latency of the tilemap, physics, effects and whole frames")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--enemies", type=int, default=200, help="extra enemies for the loaded frame benchmark")
+    parser.add_argument("--particles", type=int, default=2000, help="particle and spark count for the effect and loaded frame benchmarks")
+    parser.add_argument("--map", action="append", default=[], metavar="PATH", help="benchmark another map too, e.g. a generated stress map")
+    parser.add_argument("--filter", help="only keep benchmarks whose name contains this")
+    parser.add_argument("--out", metavar="PATH", help="write the JSON report here as well as to stdout")
+    parser.add_argument("--baseline", metavar="PATH", help="compare p50s against an earlier report, exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed p50 slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
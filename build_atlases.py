@@ -0,0 +1,15 @@
+import os
+import pygame
+from modules.assets import AssetLoader, ATLAS_PAGES
+
+if __name__ == "__main__":
+    # convert() needs a display, but not a visible one
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+
+    loader = AssetLoader()
+    for page in ATLAS_PAGES:
+        regions = loader.load_page(page)
+        print(page + ": " + str(len(regions)) + " regions in " + "x".join(str(n) for n in next(iter(regions.values())).get_parent().get_size()))
+    print(str(loader.misses) + " pages rebuilt, " + str(loader.hits) + " already up to date")
@@ -0,0 +1,20 @@
+import os
+import sys
+from modules.tilemap import Tilemap, COMPILED_EXTENSION
+
+MAPS_PATH = "data/maps"
+
+
+def compile_map(path):
+    # Writes the compiled copy of a JSON map next to it
+    tilemap = Tilemap(None)
+    tilemap.load(path)
+    compiled_path = os.path.splitext(path)[0] + COMPILED_EXTENSION
+    tilemap.save(compiled_path)
+    return compiled_path
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or [os.path.join(MAPS_PATH, name) for name in sorted(os.listdir(MAPS_PATH)) if name.endswith(".json")]
+    for path in paths:
+        print(path + " -> " + compile_map(path))
@@ -1,13 +1,13 @@
 import sys
 import pygame
 from modules.tilemap import Tilemap
-from utils import load_image, load_images
+from modules.assets import AssetLoader, LazyAssets, EDITOR_ASSETS
 
 RENDER_SCALE = 2.0
 
 
 class Editor:
-    def __init__(self):
+    def __init__(self, map_path="map.json"):
         pygame.init()
 
         pygame.display.set_caption("Level editor")
@@ -17,13 +17,7 @@ class Editor:
 
         self.clock = pygame.time.Clock()
 
-        self.assets = {
-            "decor": load_images("tiles/decor"),
-            "grass": load_images("tiles/grass"),
-            "large_decor": load_images("tiles/large_decor"),
-            "stone": load_images("tiles/stone"),
-            "spawners": load_images("tiles/spawners"),
-        }
+        self.assets = LazyAssets(AssetLoader(), EDITOR_ASSETS)
 
         self.movement = [False, False, False, False]
 
@@ -31,8 +25,9 @@ class Editor:
 
         self.tilemap = Tilemap(self, tile_size=16)
 
+        self.map_path = map_path
         try:
-            self.tilemap.load("map.json")
+            self.tilemap.load(self.map_path)
         except FileNotFoundError:
             pass
 
@@ -79,27 +74,11 @@ class Editor:
             else:
                 self.display.blit(current_tile_image, mouse_pos)
 
-            tile_loc = str(tile_pos[0]) + ";" + str(tile_pos[1])
-
             if self.clicking and self.ongrid:
-                self.tilemap.tilemap[tile_loc] = {
-                    "type": self.tile_list[self.tile_group],
-                    "variant": self.tile_variant,
-                    "pos": tile_pos,
-                }
+                self.tilemap.set_tile(tile_pos, self.tile_list[self.tile_group], self.tile_variant)
             elif self.right_clicking:
-                if tile_loc in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_loc]
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_img = self.assets[tile["type"]][tile["variant"]]
-                    tile_r = pygame.Rect(
-                        tile["pos"][0] - self.scroll[0],
-                        tile["pos"][1] - self.scroll[1],
-                        tile_img.get_width(),
-                        tile_img.get_height(),
-                    )
-                    if tile_r.collidepoint(mouse_pos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                self.tilemap.remove_tile(tile_pos)
+                self.tilemap.remove_offgrids(self.tilemap.offgrid_in_rect((mouse_pos[0] + self.scroll[0], mouse_pos[1] + self.scroll[1], 1, 1)))
 
             self.display.blit(current_tile_image, (5, 5))
 
@@ -113,7 +92,7 @@ class Editor:
                     if event.button == 1:
                         self.clicking = True
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append(
+                            self.tilemap.add_offgrid(
                                 {
                                     "type": self.tile_list[self.tile_group],
                                     "variant": self.tile_variant,
@@ -156,7 +135,7 @@ class Editor:
                     elif event.key == pygame.K_t:
                         self.tilemap.auto_tile()
                     elif event.key == pygame.K_o:
-                        self.tilemap.save("map.json")
+                        self.tilemap.save(self.map_path)
                     elif event.key in [pygame.K_LSHIFT, pygame.K_RSHIFT]:
                         self.shift = True
                 elif event.type == pygame.KEYUP:
@@ -177,4 +156,6 @@ class Editor:
             self.clock.tick(60)
 
 
-Editor().run()
+if __name__ == "__main__":
+    # Edits map.json unless given a .json or compiled map path
+    Editor(sys.argv[1] if len(sys.argv) > 1 else "map.json").run()
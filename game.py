@@ -1,19 +1,47 @@
 import os
 import sys
-import math
+import time
 import random
+import argparse
 import pygame
 from modules.entities import Player, Enemy
-from modules.tilemap import Tilemap
+from modules.enemies import EnemySystem
+from modules.projectiles import ProjectileSystem
+from modules.tilemap import Tilemap, COMPILED_EXTENSION, map_tile_types, compiled_map_ok, load_map_data
 from modules.clouds import Clouds
-from modules.animations import Animation
-from modules.particles import Particle
-from modules.sparks import Spark
-from utils import load_image, load_images
+from modules.particles import ParticleSystem
+from modules.sparks import SparkSystem
+from modules.profiler import Profiler, NullProfiler
+from modules.outline import Outline
+from modules.level import LevelTemplate
+from modules.assets import AssetLoader, LazyAssets, GAME_ASSETS
+from modules.audio import AudioManager, NullAudio, MUSIC_FADE_MS
+from modules.replay import Replay
+from modules.effects import burst
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, headless=False, profile_path=None, batch_enemies=True, seed=None, record_path=None):
+        self.headless = headless
+        # Gameplay draws from the global random module, so a seed plus the
+        # per-frame inputs is enough to replay a session exactly
+        if record_path and seed is None:
+            seed = random.getrandbits(32)
+        if seed is not None:
+            random.seed(seed)
+        self.record_path = record_path
+        self.replay = Replay(seed) if record_path else None
+        # Screenshake has its own generator, so rendering never changes the gameplay stream
+        self.shake_rng = random.Random(seed)
+        # Simulate every enemy in one EnemySystem pass instead of one Enemy object each
+        self.batch_enemies = batch_enemies
+        self.profile_path = profile_path
+        self.profiler = Profiler() if profile_path else NullProfiler()
+        if headless:
+            # No window or sound card needed, e.g. for soak tests on CI
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            os.environ["SDL_AUDIODRIVER"] = "dummy"
+
         pygame.init()
 
         pygame.display.set_caption("Ninja G4M3")
@@ -21,45 +49,22 @@ class Game:
 
         self.display = pygame.Surface((320, 240), pygame.SRCALPHA)
         self.display_2 = pygame.Surface((320, 240))
+        self.outline = Outline(self.display.get_size())
+
+        # Iris wipe, only redrawn when its radius changes
+        self.transition_surf = pygame.Surface(self.display.get_size())
+        self.transition_surf.set_colorkey((255, 255, 255))
+        self.transition_radius = None
 
         self.clock = pygame.time.Clock()
 
         self.movement = [False, False]
 
-        self.assets = {
-            "decor": load_images("tiles/decor"),
-            "grass": load_images("tiles/grass"),
-            "large_decor": load_images("tiles/large_decor"),
-            "stone": load_images("tiles/stone"),
-            "clouds": load_images("clouds"),
-            "player": load_image("entities/player.png"),
-            "background": load_image("background.png"),
-            "enemy/idle": Animation(load_images("entities/enemy/idle"), img_dur=6),
-            "enemy/run": Animation(load_images("entities/enemy/run"), img_dur=4),
-            "player/idle": Animation(load_images("entities/player/idle"), img_dur=6),
-            "player/run": Animation(load_images("entities/player/run"), img_dur=4),
-            "player/jump": Animation(load_images("entities/player/jump")),
-            "player/slide": Animation(load_images("entities/player/slide")),
-            "player/wall_slide": Animation(load_images("entities/player/wall_slide")),
-            "particle/leaf": Animation(load_images("particles/leaf"), img_dur=20, loop=False),
-            "particle/particle": Animation(load_images("particles/particle"), img_dur=6, loop=False),
-            "gun": load_image("gun.png"),
-            "projectile": load_image("projectile.png"),
-        }
-
-        self.sfx = {
-            "jump": pygame.mixer.Sound("data/sfx/jump.wav"),
-            "dash": pygame.mixer.Sound("data/sfx/dash.wav"),
-            "hit": pygame.mixer.Sound("data/sfx/hit.wav"),
-            "shoot": pygame.mixer.Sound("data/sfx/shoot.wav"),
-            "ambience": pygame.mixer.Sound("data/sfx/ambience.wav"),
-        }
-
-        self.sfx["jump"].set_volume(0.2)
-        self.sfx["dash"].set_volume(0.3)
-        self.sfx["hit"].set_volume(0.8)
-        self.sfx["shoot"].set_volume(0.4)
-        self.sfx["ambience"].set_volume(0.7)
+        self.asset_loader = AssetLoader()
+        self.assets = LazyAssets(self.asset_loader, GAME_ASSETS)
+
+        # Headless runs skip loading and mixing sound altogether
+        self.audio = NullAudio() if headless else AudioManager()
 
         self.clouds = Clouds(self.assets["clouds"], count=16)
 
@@ -70,210 +75,334 @@ class Game:
         self.tilemap = Tilemap(self, tile_size=16)
 
         self.level = 0
+        self.level_template = None
+        # (path, parsed data) of a JSON map read ahead during the level transition
+        self.next_map = None
         self.load_level(self.level)
 
         self.screenshake = 0
-        self.max_levels = len(os.listdir("data/maps")) - 1
+        self.max_levels = len({os.path.splitext(name)[0] for name in os.listdir("data/maps")}) - 1
+
+    def map_path(self, map_id):
+        # Prefer the compiled map unless the JSON has been edited since it was built,
+        # or it was compiled by a build with a different map format
+        json_path = "data/maps/" + str(map_id) + ".json"
+        compiled_path = "data/maps/" + str(map_id) + COMPILED_EXTENSION
+        if os.path.exists(compiled_path) and (not os.path.exists(json_path) or os.path.getmtime(compiled_path) >= os.path.getmtime(json_path)):
+            if compiled_map_ok(compiled_path) or not os.path.exists(json_path):
+                return compiled_path
+        return json_path
 
     def load_level(self, map_id):
-        self.tilemap.load("data/maps/" + str(map_id) + ".json")
-        # self.tilemap.load("map.json")
-        self.leaf_spawners = []
-        for tree in self.tilemap.extract([("large_decor", 2)], keep=True):
-            self.leaf_spawners.append(pygame.Rect(4 + tree["pos"][0], 4 + tree["pos"][1], 23, 13))
-
-        self.enemies = []
-        for spawner in self.tilemap.extract([("spawners", 0), ("spawners", 1)]):
-            if spawner["variant"] == 0:
-                self.player.pos = spawner["pos"]
-                self.player.air_time = 0
-            else:
-                self.enemies.append(Enemy(self, spawner["pos"], (8, 15)))
-
-        # [[x, y], direction, timer]
-        self.projectiles = []
-        self.particles = []
-        self.sparks = []
+        # Only a new level touches the disk, respawns reuse the loaded template
+        if self.level_template is None or self.level_template.map_id != map_id:
+            path = self.map_path(map_id)
+            map_data = self.next_map[1] if self.next_map and self.next_map[0] == path else None
+            self.level_template = LevelTemplate(self.tilemap, map_id, path, map_data)
+        else:
+            self.tilemap.restore(self.level_template.tiles)
+        self.next_map = None
+
+        self.leaf_spawners = self.level_template.leaf_spawners
+        # Next level's tile assets still to load, None until the level is cleared
+        self.preload_queue = None
+
+        if self.level_template.player_spawn:
+            self.player.pos = list(self.level_template.player_spawn)
+            self.player.air_time = 0
+
+        if self.batch_enemies:
+            self.enemies = EnemySystem(self, (8, 15))
+            for pos in self.level_template.enemy_spawns:
+                self.enemies.add(pos)
+        else:
+            self.enemies = [Enemy(self, pos, (8, 15)) for pos in self.level_template.enemy_spawns]
+
+        self.projectiles = ProjectileSystem(self)
+        self.particles = ParticleSystem(self)
+        self.sparks = SparkSystem()
 
         self.scroll = [0, 0]
         self.dead = 0
         self.transition = -30
 
-    def run(self):
-        pygame.mixer.music.load("data/music.wav")
-        pygame.mixer.music.set_volume(0.5)
-        pygame.mixer.music.play(-1)
+    def step(self, inputs=()):
+        # Advance the simulation one frame. inputs holds the actions for this
+        # frame: "left" and "right" while held, "jump" and "dash" when pressed.
+        if self.replay is not None:
+            self.replay.record(inputs)
+
+        self.audio.begin_frame()
+        self.movement = ["left" in inputs, "right" in inputs]
+        if "jump" in inputs:
+            self.player.jump()
+        if "dash" in inputs:
+            self.player.dash()
+
+        self.screenshake = max(0, self.screenshake - 1)
+
+        if not len(self.enemies):
+            # Use the fade out to fade out the music and load the next level's tiles, one asset per frame.
+            # A compiled map lists its types in the header, a JSON map is parsed here once and handed to the level load.
+            if self.preload_queue is None:
+                next_level = min(self.max_levels, self.level + 1)
+                self.preload_queue = []
+                if next_level != self.level_template.map_id:
+                    path = self.map_path(next_level)
+                    if not path.endswith(COMPILED_EXTENSION):
+                        self.next_map = (path, load_map_data(path))
+                    self.preload_queue = sorted(map_tile_types(path, self.next_map[1] if self.next_map else None))
+                self.audio.fade_music(next_level)
+            elif self.preload_queue:
+                self.assets.preload([self.preload_queue.pop()])
+            self.transition += 1
+            if self.transition > 30:
+                self.level = min(self.max_levels, self.level + 1)
+                self.load_level(self.level)
+                self.audio.play_music(self.level, fade_ms=MUSIC_FADE_MS)
+        if self.transition < 0:
+            self.transition += 1
+
+        if self.dead:
+            self.dead += 1
+            if self.dead == 10:
+                self.transition = min(30, self.transition + 1)
+            if self.dead > 40:
+                # Reset player velocity after death
+                self.player.velocity = [0, 0]
+                self.load_level(self.level)
+
+        # Calculate camera position
+        self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 30
+
+        self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1]) / 30
+
+        # Spawn particles
+        for rect in self.leaf_spawners:
+            if random.random() * 49999 < rect.width * rect.height:
+                pos = (
+                    rect.x + random.random() * rect.width,
+                    rect.y + random.random() * rect.height,
+                )
+                self.particles.add(
+                    "leaf",
+                    pos,
+                    velocity=[
+                        random.uniform(0.1, 0.4),
+                        random.uniform(0.2, 0.4),
+                    ],
+                    frame=random.randint(0, 20),
+                )
+        self.profiler.lap("update/level")
 
-        self.sfx["ambience"].play(-1)
+        self.clouds.update()
+        self.profiler.lap("update/clouds")
 
-        while True:
-            self.display.fill((0, 0, 0, 0))
-            self.display_2.blit(self.assets["background"], (0, 0))
-
-            self.screenshake = max(0, self.screenshake - 1)
-
-            if not len(self.enemies):
-                self.transition += 1
-                if self.transition > 30:
-                    self.level = min(self.max_levels, self.level + 1)
-                    self.load_level(self.level)
-            if self.transition < 0:
-                self.transition += 1
-
-            if self.dead:
-                self.dead += 1
-                if self.dead == 10:
-                    self.transition = min(30, self.transition + 1)
-                if self.dead > 40:
-                    # Reset player velocity after death
-                    self.player.velocity = [0, 0]
-                    self.load_level(self.level)
-
-            # Calculate camera position
-            self.scroll[0] += (self.player.rect().centerx - self.display.get_width() / 2 - self.scroll[0]) / 30
-
-            self.scroll[1] += (self.player.rect().centery - self.display.get_height() / 2 - self.scroll[1]) / 30
-
-            render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
-
-            # Spawn particles
-            for rect in self.leaf_spawners:
-                if random.random() * 49999 < rect.width * rect.height:
-                    pos = (
-                        rect.x + random.random() * rect.width,
-                        rect.y + random.random() * rect.height,
-                    )
-                    self.particles.append(
-                        Particle(
-                            self,
-                            "leaf",
-                            pos,
-                            velocity=[
-                                random.uniform(0.1, 0.4),
-                                random.uniform(0.2, 0.4),
-                            ],
-                            frame=random.randint(0, 20),
-                        )
-                    )
-
-            # Insert clouds
-            self.clouds.update()
-            self.clouds.render(self.display, offset=render_scroll)
-
-            # Render tiles
-            self.tilemap.render(self.display, offset=render_scroll)
-
-            # Render enemies
+        # Update enemies
+        if self.batch_enemies:
+            self.enemies.update(self.tilemap, view=(self.scroll[0], self.scroll[1], self.display.get_width(), self.display.get_height()))
+        else:
             for enemy in self.enemies.copy():
                 kill = enemy.update(self.tilemap, (0, 0))
-                enemy.render(self.display, offset=render_scroll)
                 if kill:
                     self.enemies.remove(enemy)
+        self.profiler.lap("update/enemies")
 
-            # Render player
-            if not self.dead:
-                self.player.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-                self.player.render(self.display, offset=render_scroll)
-
-            # Projectiles
-            for projectile in self.projectiles.copy():
-                projectile[0][0] += projectile[1]
-                projectile[2] += 1
-                img = self.assets["projectile"]
-                self.display.blit(
-                    img,
-                    (
-                        projectile[0][0] - img.get_width() / 2 - render_scroll[0],
-                        projectile[0][1] - img.get_height() / 2 - render_scroll[1],
-                    ),
-                )
-                if self.tilemap.solid_check(projectile[0]) or projectile[2] > 360:
-                    for i in range(4):
-                        self.sparks.append(
-                            Spark(
-                                self.projectiles[0][0],
-                                random.random() - 0.5 + (math.pi if projectile[1] > 0 else 0),
-                                2 + random.random(),
-                            )
-                        )
-
-                    self.projectiles.remove(projectile)
-                elif abs(self.player.dashing) < 50 and self.player.rect().collidepoint(projectile[0]):
-                    self.projectiles.remove(projectile)
-                    self.dead += 1
-                    self.sfx["hit"].play()
-                    self.screenshake = max(16, self.screenshake)
-                    for i in range(30):
-                        angle = random.random() * math.pi * 2
-                        speed = random.random() * 5
-                        self.sparks.append(Spark(self.player.rect().center, angle, 2 + random.random()))
-                        self.particles.append(
-                            Particle(
-                                self,
-                                "particle",
-                                self.player.rect().center,
-                                velocity=[math.cos(angle + math.pi) * speed - 0.5, math.sin(angle + math.pi) * speed * 0.5],
-                                frame=random.randint(0, 7),
-                            )
-                        )
-
-            # Sparks
-            for spark in self.sparks.copy():
-                kill = spark.update()
-                spark.render(self.display, offset=render_scroll)
-                if kill:
-                    self.sparks.remove(spark)
-
-            display_mask = pygame.mask.from_surface(self.display)
-            display_sillhouette = display_mask.to_surface(setcolor=(0, 0, 0, 180), unsetcolor=(0, 0, 0, 0))
-            for offset in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-                self.display_2.blit(display_sillhouette, offset)
-
-            # Manage particles and remove killed ones
-            for particle in self.particles.copy():
-                kill = particle.update()
-                particle.render(self.display, offset=render_scroll)
-                if particle.type == "leaf":
-                    particle.pos[0] += math.sin(particle.animation.frame * 0.035) * 0.35
-                if kill:
-                    self.particles.remove(particle)
-
-            # Listen to user events
-            for event in pygame.event.get():
-                # Take care of closing the window
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT:
-                        self.movement[0] = True
-                    elif event.key == pygame.K_RIGHT:
-                        self.movement[1] = True
-                    elif event.key == pygame.K_UP:
-                        self.player.jump()
-                    elif event.key in [pygame.K_x, pygame.K_KP_0]:
-                        self.player.dash()
-                elif event.type == pygame.KEYUP:
-                    if event.key == pygame.K_LEFT:
-                        self.movement[0] = False
-                    elif event.key == pygame.K_RIGHT:
-                        self.movement[1] = False
-
-            if self.transition:
-                transition_surf = pygame.Surface(self.display.get_size())
-                pygame.draw.circle(
-                    transition_surf, (255, 255, 255), (self.display.get_width() // 2, self.display.get_height() // 2), (30 - abs(self.transition)) * 8
-                )
-                transition_surf.set_colorkey((255, 255, 255))
-                self.display.blit(transition_surf, (0, 0))
+        # Update player
+        if not self.dead:
+            self.player.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
+        self.profiler.lap("update/player")
+
+        # Projectiles
+        self.projectiles.update(self.tilemap)
+        self.profiler.lap("update/projectiles")
 
-            self.display_2.blit(self.display, (0, 0))
+        self.sparks.update()
+        self.profiler.lap("update/sparks")
 
-            screenshake_offset = (random.random() * self.screenshake - self.screenshake / 2, random.random() * self.screenshake - self.screenshake / 2)
-            self.screen.blit(pygame.transform.scale(self.display_2, self.screen.get_size()), screenshake_offset)
-            pygame.display.update()
+        self.particles.update()
+        self.profiler.lap("update/particles")
+
+    def hit_player(self):
+        self.dead += 1
+        self.audio.play("hit")
+        self.screenshake = max(16, self.screenshake)
+        burst(self, self.player.rect().center)
+
+    def render(self):
+        self.display.fill((0, 0, 0, 0))
+
+        render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
+        self.profiler.lap("render/clear")
+
+        # Insert clouds
+        self.clouds.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/clouds")
+
+        # Render tiles
+        self.tilemap.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/tilemap")
+
+        # Render enemies
+        if self.batch_enemies:
+            self.enemies.render(self.display, offset=render_scroll)
+        else:
+            for enemy in self.enemies:
+                enemy.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/enemies")
+
+        # Render player
+        if not self.dead:
+            self.player.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/player")
+
+        # Projectiles
+        self.projectiles.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/projectiles")
+
+        # Sparks
+        self.sparks.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/sparks")
+
+        self.outline.render(self.display, self.display_2, self.assets["background"])
+        self.profiler.lap("render/outline")
+
+        # Particles
+        self.particles.render(self.display, offset=render_scroll)
+        self.profiler.lap("render/particles")
+
+        if self.transition:
+            radius = (30 - abs(self.transition)) * 8
+            if radius != self.transition_radius:
+                self.transition_surf.fill((0, 0, 0))
+                pygame.draw.circle(self.transition_surf, (255, 255, 255), (self.display.get_width() // 2, self.display.get_height() // 2), radius)
+                self.transition_radius = radius
+            self.display.blit(self.transition_surf, (0, 0))
+        self.profiler.lap("render/transition")
+
+        self.display_2.blit(self.display, (0, 0))
+
+        screenshake_offset = (self.shake_rng.random() * self.screenshake - self.screenshake / 2, self.shake_rng.random() * self.screenshake - self.screenshake / 2)
+        self.screen.blit(pygame.transform.scale(self.display_2, self.screen.get_size()), screenshake_offset)
+        self.profiler.lap("render/scale")
+
+        self.profiler.render_overlay(self.screen)
+        pygame.display.update()
+        self.profiler.lap("render/present")
+
+    def poll_inputs(self):
+        inputs = set()
+
+        # Listen to user events
+        for event in pygame.event.get():
+            # Take care of closing the window
+            if event.type == pygame.QUIT:
+                self.quit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_LEFT:
+                    self.movement[0] = True
+                elif event.key == pygame.K_RIGHT:
+                    self.movement[1] = True
+                elif event.key == pygame.K_UP:
+                    inputs.add("jump")
+                elif event.key in [pygame.K_x, pygame.K_KP_0]:
+                    inputs.add("dash")
+                elif event.key == pygame.K_F3:
+                    self.profiler.overlay = not self.profiler.overlay
+            elif event.type == pygame.KEYUP:
+                if event.key == pygame.K_LEFT:
+                    self.movement[0] = False
+                elif event.key == pygame.K_RIGHT:
+                    self.movement[1] = False
+
+        if self.movement[0]:
+            inputs.add("left")
+        if self.movement[1]:
+            inputs.add("right")
+
+        self.profiler.lap("events")
+        return inputs
+
+    def quit(self):
+        if self.profile_path:
+            self.profiler.dump(self.profile_path)
+        if self.replay is not None:
+            self.replay.save(self.record_path)
+
+        pygame.quit()
+        sys.exit()
+
+    def run(self):
+        self.audio.play_music(self.level)
+        self.audio.start_ambience()
+
+        inputs = set()
+        while True:
+            self.profiler.begin_frame()
+            self.step(inputs)
+            self.render()
+            inputs = self.poll_inputs()
+            self.profiler.end_frame()
             # Force the loop to run at 60 FPS
             self.clock.tick(60)
 
-
-Game().run()
+    def simulate(self, input_stream, render=False):
+        # Step through a scripted input stream as fast as possible
+        frames = 0
+        for inputs in input_stream:
+            self.profiler.begin_frame()
+            self.step(inputs)
+            if render:
+                self.render()
+            self.profiler.end_frame()
+            frames += 1
+
+        return frames
+
+
+def scripted_inputs(frames, seed=0):
+    # A repeatable stream of held directions with the odd jump and dash
+    rng = random.Random(seed)
+    held = set()
+    for frame in range(frames):
+        if rng.random() < 0.05:
+            held = set(rng.choice([(), ("left",), ("right",)]))
+        inputs = set(held)
+        if rng.random() < 0.03:
+            inputs.add("jump")
+        if rng.random() < 0.01:
+            inputs.add("dash")
+        yield inputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--headless", action="store_true", help="simulate scripted input without a window, uncapped")
+    parser.add_argument("--frames", type=int, default=3600)
+    parser.add_argument("--seed", type=int, help="seed for gameplay randomness, 0 for scripted runs")
+    parser.add_argument("--render", action="store_true", help="also render each frame in headless mode")
+    parser.add_argument("--profile", metavar="PATH", help="time each frame section and write a .json summary or .csv of frames on exit")
+    parser.add_argument("--unbatched", action="store_true", help="update enemies one Enemy object at a time")
+    parser.add_argument("--record", metavar="PATH", help="save the seed and every frame's input to a replay file on exit")
+    parser.add_argument("--replay", metavar="PATH", help="play a recorded replay back headless, uncapped")
+    args = parser.parse_args()
+
+    if args.headless or args.replay:
+        if args.replay:
+            replay = Replay.load(args.replay)
+            seed, input_stream = replay.seed, replay.inputs()
+        else:
+            seed = args.seed or 0
+            input_stream = scripted_inputs(args.frames, seed)
+
+        game = Game(headless=True, profile_path=args.profile, batch_enemies=not args.unbatched, seed=seed, record_path=args.record)
+        start = time.perf_counter()
+        frames = game.simulate(input_stream, render=args.render)
+        elapsed = time.perf_counter() - start
+        print(str(frames) + " frames in " + str(round(elapsed, 3)) + "s (" + str(round(frames / elapsed)) + " fps)")
+        if args.profile:
+            game.profiler.dump(args.profile)
+        if args.record:
+            game.replay.save(args.record)
+    else:
+        Game(profile_path=args.profile, batch_enemies=not args.unbatched, seed=args.seed, record_path=args.record).run()
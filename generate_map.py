@@ -0,0 +1,99 @@
+import os
+import time
+import random
+import argparse
+import pygame
+from modules.tilemap import Tilemap, EMPTY
+from utils import BASE_IMAGE_PATH
+
+TERRAIN_TYPES = ["grass", "stone"]
+DECOR_TYPES = ["decor", "large_decor"]
+
+# Spawners sit this far above the ground and drop onto it, like in the shipped maps
+SPAWNER_HEIGHT = 16
+
+
+def image_sizes(tile_type):
+    folder = os.path.join(BASE_IMAGE_PATH, "tiles", tile_type)
+    return [pygame.image.load(os.path.join(folder, name)).get_size() for name in sorted(os.listdir(folder))]
+
+
+def fill(tilemap, x, y, tile_type):
+    # Returns whether the cell was empty before
+    empty = tilemap.tile_id_at(x, y) == EMPTY
+    tilemap.set_tile((x, y), tile_type, 0)
+    return empty
+
+
+def generate(width, height, density=0.3, decor=0, enemies=0, seed=0, tile_size=16):
+    # A width x height tile map about density full, with decor and enemy spawners standing on its surfaces
+    rng = random.Random(seed)
+    tilemap = Tilemap(None, tile_size=tile_size)
+    target = int(width * height * density)
+    placed = 0
+
+    # Rolling ground three tiles deep, switching terrain type every so often
+    tile_type = rng.choice(TERRAIN_TYPES)
+    ground = height * 2 // 3
+    for x in range(width):
+        if rng.random() < 0.03:
+            tile_type = rng.choice(TERRAIN_TYPES)
+        ground = min(height - 1, max(height // 3, ground + rng.choice([-1, 0, 0, 0, 1])))
+        for y in range(ground, min(height, ground + 3)):
+            placed += fill(tilemap, x, y, tile_type)
+
+    # Floating platforms make up the rest of the density
+    attempts = 0
+    while placed < target and attempts < target * 4:
+        attempts += 1
+        length = rng.randint(3, 12)
+        thickness = rng.randint(1, 3)
+        px = rng.randint(0, max(0, width - length))
+        py = rng.randint(0, max(0, height - thickness))
+        tile_type = rng.choice(TERRAIN_TYPES)
+        for x in range(px, min(width, px + length)):
+            for y in range(py, min(height, py + thickness)):
+                placed += fill(tilemap, x, y, tile_type)
+
+    tilemap.auto_tile()
+
+    # Anything with two free tiles above it can be stood on
+    surfaces = sorted((x, y) for x, y, t_id, variant in tilemap.grid_tiles() if tilemap.tile_id_at(x, y - 1) == EMPTY and tilemap.tile_id_at(x, y - 2) == EMPTY)
+    if not surfaces:
+        return tilemap
+
+    sizes = {decor_type: image_sizes(decor_type) for decor_type in DECOR_TYPES}
+    for i in range(decor):
+        x, y = rng.choice(surfaces)
+        decor_type = rng.choice(DECOR_TYPES)
+        variant = rng.randrange(len(sizes[decor_type]))
+        w, h = sizes[decor_type][variant]
+        pos = [round(x * tile_size + rng.uniform(-w / 2, tile_size - w / 2), 1), float(y * tile_size - h)]
+        tilemap.add_offgrid({"type": decor_type, "variant": variant, "pos": pos})
+
+    # The player starts on the leftmost surface
+    x, y = surfaces[0]
+    tilemap.add_offgrid({"type": "spawners", "variant": 0, "pos": [float(x * tile_size + 4), float(y * tile_size - SPAWNER_HEIGHT)]})
+    for i in range(enemies):
+        x, y = rng.choice(surfaces)
+        tilemap.add_offgrid({"type": "spawners", "variant": 1, "pos": [float(x * tile_size + 4), float(y * tile_size - SPAWNER_HEIGHT)]})
+
+    return tilemap
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a procedurally generated stress map, .json or compiled .map")
+    parser.add_argument("path")
+    parser.add_argument("--width", type=int, default=256, help="in tiles")
+    parser.add_argument("--height", type=int, default=64, help="in tiles")
+    parser.add_argument("--density", type=float, default=0.3, help="fraction of cells holding a grid tile")
+    parser.add_argument("--decor", type=int, default=500, help="offgrid decor pieces")
+    parser.add_argument("--enemies", type=int, default=50, help="enemy spawners, on top of the one player spawner")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tilemap = generate(args.width, args.height, args.density, args.decor, args.enemies, args.seed)
+    tilemap.save(args.path)
+    tiles = sum(chunk.count for chunk in tilemap.chunks.values())
+    print(args.path + ": " + str(tiles) + " tiles, " + str(len(tilemap.offgrid_tiles)) + " offgrid in " + str(round(time.perf_counter() - start, 2)) + "s")
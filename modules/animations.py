@@ -1,6 +1,11 @@
+from utils import flip_images
+
+
 class Animation:
-    def __init__(self, images, img_dur=5, loop=True):
+    def __init__(self, images, img_dur=5, loop=True, flipped_images=None):
         self.images = images
+        # Mirrored frames, made once so rendering never has to flip
+        self.flipped_images = flipped_images if flipped_images is not None else flip_images(images)
         self.img_duration = img_dur
         self.loop = loop
         self.done = False
@@ -8,7 +13,7 @@ class Animation:
         self.frame = 0
 
     def copy(self):
-        return Animation(self.images, self.img_duration, self.loop)
+        return Animation(self.images, self.img_duration, self.loop, self.flipped_images)
 
     def update(self):
         if self.loop:
@@ -18,5 +23,7 @@ class Animation:
             if self.frame >= self.img_duration * len(self.images) - 1:
                 self.done = True
 
-    def img(self):
+    def img(self, flip=False):
+        if flip:
+            return self.flipped_images[int(self.frame / self.img_duration)]
         return self.images[int(self.frame / self.img_duration)]
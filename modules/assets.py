@@ -0,0 +1,303 @@
+import os
+import struct
+import pygame
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from modules.animations import Animation
+from utils import BASE_IMAGE_PATH
+
+CACHE_DIR = "data/cache"
+CACHE_VERSION = 3
+
+# Atlas cache layout, little endian: header, key (utf-8 "path:mtime" lines),
+# one rect per region, then the atlas pixels as packed RGB
+CACHE_MAGIC = b"NATL"
+CACHE_HEADER = struct.Struct("<4sHHHII")
+CACHE_RECT = struct.Struct("<HHHH")
+
+ATLAS_WIDTH = 512
+
+# Budget for loaded atlas pages before the least recently used ones are dropped
+MAX_ASSET_BYTES = 64 * 1024 * 1024
+
+# Every asset the game or the editor can ask for: name -> (kind, path, options)
+MANIFEST = {
+    "decor": ("images", "tiles/decor", {}),
+    "grass": ("images", "tiles/grass", {}),
+    "large_decor": ("images", "tiles/large_decor", {}),
+    "stone": ("images", "tiles/stone", {}),
+    "spawners": ("images", "tiles/spawners", {}),
+    "clouds": ("images", "clouds", {}),
+    "player": ("image", "entities/player.png", {}),
+    "background": ("image", "background.png", {}),
+    "enemy/idle": ("animation", "entities/enemy/idle", {"img_dur": 6}),
+    "enemy/run": ("animation", "entities/enemy/run", {"img_dur": 4}),
+    "player/idle": ("animation", "entities/player/idle", {"img_dur": 6}),
+    "player/run": ("animation", "entities/player/run", {"img_dur": 4}),
+    "player/jump": ("animation", "entities/player/jump", {}),
+    "player/slide": ("animation", "entities/player/slide", {}),
+    "player/wall_slide": ("animation", "entities/player/wall_slide", {}),
+    "particle/leaf": ("animation", "particles/leaf", {"img_dur": 20, "loop": False}),
+    "particle/particle": ("animation", "particles/particle", {"img_dur": 6, "loop": False}),
+    "gun": ("image", "gun.png", {}),
+    "gun/flipped": ("image", "gun.png", {"flip": True}),
+    "projectile": ("image", "projectile.png", {}),
+}
+
+TILE_ASSETS = ["decor", "grass", "large_decor", "stone"]
+GAME_ASSETS = TILE_ASSETS + [name for name in MANIFEST if name not in TILE_ASSETS and name != "spawners"]
+EDITOR_ASSETS = TILE_ASSETS + ["spawners"]
+
+# Images are packed into one atlas surface per page, which is also the unit of caching.
+# Each tile set gets its own page so a level only pays for the tiles it uses.
+ATLAS_PAGES = {
+    "decor": ["decor"],
+    "grass": ["grass"],
+    "large_decor": ["large_decor"],
+    "stone": ["stone"],
+    "spawners": ["spawners"],
+    "scenery": ["clouds", "background"],
+    "entities": ["player", "enemy/idle", "enemy/run", "player/idle", "player/run", "player/jump", "player/slide", "player/wall_slide", "gun", "gun/flipped", "projectile"],
+    "particles": ["particle/leaf", "particle/particle"],
+}
+ASSET_PAGES = {name: page for page, names in ATLAS_PAGES.items() for name in names}
+
+# Pages whose images game objects hold on to (Player.animation, EnemySystem.anims,
+# ParticleSystem.anims, Clouds). Dropping them would not free anything, the next
+# lookup would just load a second copy, so they are never evicted. Tile pages are
+# looked up through LazyAssets on every use and are the ones that get dropped.
+PINNED_PAGES = ["scenery", "entities", "particles"]
+
+
+def asset_files(name):
+    kind, path, options = MANIFEST[name]
+    if kind == "image":
+        return [path]
+    return [os.path.join(path, img_name) for img_name in sorted(os.listdir(os.path.join(BASE_IMAGE_PATH, path)))]
+
+
+def page_regions(page):
+    # (path, flipped) for every region a page holds, in a stable order
+    regions = []
+    for name in ATLAS_PAGES[page]:
+        kind, path, options = MANIFEST[name]
+        for img_path in asset_files(name):
+            for region in [(img_path, False), (img_path, True)] if kind == "animation" else [(img_path, bool(options.get("flip")))]:
+                if region not in regions:
+                    regions.append(region)
+
+    return regions
+
+
+def cache_key(mtimes):
+    return "\n".join(path + ":" + str(mtime) for path, mtime in mtimes.items()).encode("utf-8")
+
+
+def pack(sizes, width=ATLAS_WIDTH):
+    # Shelf packing, tallest images first. Returns a rect per size and the atlas height.
+    rects = [None] * len(sizes)
+    x = y = shelf_height = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w > width:
+            x = 0
+            y += shelf_height
+            shelf_height = 0
+        rects[i] = (x, y, w, h)
+        x += w
+        shelf_height = max(shelf_height, h)
+
+    return rects, y + shelf_height
+
+
+def decode_image(path):
+    return pygame.image.load(os.path.join(BASE_IMAGE_PATH, path))
+
+
+class AssetLoader:
+    def __init__(self, cache_dir=CACHE_DIR, workers=None):
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count() or 1
+
+        # page -> {(path, flipped): atlas subsurface}
+        self.pages = {}
+
+        # Pages served from / rebuilt into the cache, for the startup benchmark
+        self.hits = 0
+        self.misses = 0
+
+    def cache_path(self, page):
+        return os.path.join(self.cache_dir, page.replace("/", "_") + ".atlas")
+
+    def read_cache(self, page, mtimes):
+        # Only raw numbers and pixels are read back, anything that doesn't add up is a miss
+        try:
+            with open(self.cache_path(page), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < CACHE_HEADER.size:
+            return None
+
+        magic, version, width, height, rect_count, key_size = CACHE_HEADER.unpack_from(data, 0)
+        key = cache_key(mtimes)
+        i = CACHE_HEADER.size
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or data[i : i + key_size] != key:
+            return None
+        i += key_size
+        if len(data) != i + rect_count * CACHE_RECT.size + width * height * 3:
+            return None
+
+        rects = [CACHE_RECT.unpack_from(data, i + r * CACHE_RECT.size) for r in range(rect_count)]
+        i += rect_count * CACHE_RECT.size
+        return {"size": (width, height), "pixels": data[i:], "rects": rects}
+
+    def write_cache(self, page, cache):
+        key = cache_key(cache["mtimes"])
+        data = [CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, cache["size"][0], cache["size"][1], len(cache["rects"]), len(key)), key]
+        data.extend(CACHE_RECT.pack(*rect) for rect in cache["rects"])
+        data.append(cache["pixels"])
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.cache_path(page) + ".tmp", "wb") as f:
+            f.write(b"".join(data))
+        os.replace(self.cache_path(page) + ".tmp", self.cache_path(page))
+
+    def build_page(self, page, regions, mtimes):
+        paths = list(mtimes)
+
+        # PNG decoding happens off the main thread, convert() has to stay on it
+        if self.workers > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                decoded = list(pool.map(decode_image, paths))
+        else:
+            decoded = [decode_image(path) for path in paths]
+        images = {path: img.convert() for path, img in zip(paths, decoded)}
+
+        width = max([ATLAS_WIDTH] + [img.get_width() for img in images.values()])
+        rects, height = pack([images[path].get_size() for path, flipped in regions], width)
+        atlas = pygame.Surface((width, height))
+        for (path, flipped), rect in zip(regions, rects):
+            atlas.blit(pygame.transform.flip(images[path], True, False) if flipped else images[path], rect[:2])
+
+        return {
+            "mtimes": mtimes,
+            "size": atlas.get_size(),
+            "pixels": pygame.image.tobytes(atlas, "RGB"),
+            "rects": rects,
+        }
+
+    def load_page(self, page):
+        if page in self.pages:
+            return self.pages[page]
+
+        regions = page_regions(page)
+        mtimes = {}
+        for path, flipped in regions:
+            mtimes[path] = os.stat(os.path.join(BASE_IMAGE_PATH, path)).st_mtime_ns
+
+        cache = self.read_cache(page, mtimes)
+        if cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+            cache = self.build_page(page, regions, mtimes)
+            self.write_cache(page, cache)
+
+        atlas = pygame.image.frombytes(cache["pixels"], cache["size"], "RGB").convert()
+        atlas.set_colorkey((0, 0, 0))
+        self.pages[page] = {region: atlas.subsurface(rect) for region, rect in zip(regions, cache["rects"])}
+        return self.pages[page]
+
+    def page_bytes(self, page):
+        atlas = next(iter(self.pages[page].values())).get_parent()
+        return atlas.get_width() * atlas.get_height() * atlas.get_bytesize()
+
+    def unload_page(self, page):
+        self.pages.pop(page, None)
+
+    def load(self, names):
+        assets = {}
+        for name in names:
+            kind, path, options = MANIFEST[name]
+            regions = self.load_page(ASSET_PAGES[name])
+            files = asset_files(name)
+
+            if kind == "image":
+                assets[name] = regions[(files[0], bool(options.get("flip")))]
+            elif kind == "images":
+                assets[name] = [regions[(img_path, False)] for img_path in files]
+            else:
+                assets[name] = Animation(
+                    [regions[(img_path, False)] for img_path in files],
+                    flipped_images=[regions[(img_path, True)] for img_path in files],
+                    **options,
+                )
+
+        return assets
+
+
+class LazyAssets:
+    # Behaves like the assets dict, but only loads a page the first time one
+    # of its assets is looked up, and drops least recently used pages once
+    # the loaded pages go over max_bytes.
+    def __init__(self, loader, names, max_bytes=MAX_ASSET_BYTES, pinned=PINNED_PAGES):
+        self.loader = loader
+        self.names = list(names)
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+
+        self.assets = {}
+        # page -> size in bytes, least recently used first
+        self.page_sizes = OrderedDict()
+        self.bytes = 0
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __getitem__(self, name):
+        if name in self.assets:
+            self.page_sizes.move_to_end(ASSET_PAGES[name])
+            return self.assets[name]
+
+        return self.load(name)
+
+    def load(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+
+        page = ASSET_PAGES[name]
+        if page not in self.page_sizes:
+            self.loader.load_page(page)
+            self.page_sizes[page] = self.loader.page_bytes(page)
+            self.bytes += self.page_sizes[page]
+            self.evict()
+        self.page_sizes.move_to_end(page)
+
+        self.assets[name] = self.loader.load([name])[name]
+        return self.assets[name]
+
+    def evict(self):
+        # Neither pinned pages nor the newest one are dropped, even if that leaves the budget exceeded
+        newest = next(reversed(self.page_sizes), None)
+        for page in list(self.page_sizes):
+            if self.bytes <= self.max_bytes or page == newest:
+                break
+            if page in self.pinned:
+                continue
+
+            self.bytes -= self.page_sizes.pop(page)
+            self.loader.unload_page(page)
+            for name in ATLAS_PAGES[page]:
+                self.assets.pop(name, None)
+
+    def preload(self, names):
+        for name in names:
+            if name in self.names and name not in self.assets:
+                self.load(name)
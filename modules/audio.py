@@ -0,0 +1,208 @@
+import io
+import os
+import struct
+import wave
+import pygame
+from modules.assets import CACHE_DIR
+
+SAMPLE_CACHE_VERSION = 2
+# Sample cache layout, little endian: header (source mtime and mixer format), then the raw PCM
+SAMPLE_CACHE_MAGIC = b"NSFX"
+SAMPLE_CACHE_HEADER = struct.Struct("<4sHqiiiI")
+
+MIXER_CHANNELS = 16
+
+# name -> (path, volume, voice cap, priority)
+# A sound never plays on more than its voice cap of channels at once, and when
+# every channel is busy it may only take one over from a lower or equal priority sound.
+SOUNDS = {
+    "jump": ("data/sfx/jump.wav", 0.2, 2, 2),
+    "dash": ("data/sfx/dash.wav", 0.3, 1, 2),
+    "hit": ("data/sfx/hit.wav", 0.8, 3, 3),
+    "shoot": ("data/sfx/shoot.wav", 0.4, 4, 1),
+}
+
+# Music is streamed from disk by mixer.music. A level plays data/music/<level>
+# if there is one, otherwise the shared data/music track, OGG before WAV.
+MUSIC_DIR = "data/music"
+DEFAULT_MUSIC = "data/music"
+MUSIC_EXTENSIONS = (".ogg", ".wav")
+MUSIC_VOLUME = 0.5
+# As long as one half of the level transition wipe
+MUSIC_FADE_MS = 500
+
+AMBIENCE = "data/sfx/ambience.wav"
+AMBIENCE_VOLUME = 0.7
+STREAM_CHUNK_SECONDS = 0.5
+
+
+def find_track(stem):
+    for ext in MUSIC_EXTENSIONS:
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+class WavStream:
+    # Loops a WAV file on one channel a chunk at a time, so at most two chunks are ever decoded
+    def __init__(self, path, channel, volume):
+        self.channel = channel
+        self.volume = volume
+        self.wav = wave.open(path, "rb")
+        self.chunk_frames = int(self.wav.getframerate() * STREAM_CHUNK_SECONDS)
+
+    def next_chunk(self):
+        frames = self.wav.readframes(self.chunk_frames)
+        if len(frames) < self.chunk_frames * self.wav.getsampwidth() * self.wav.getnchannels():
+            self.wav.rewind()
+            frames += self.wav.readframes(self.chunk_frames - len(frames) // (self.wav.getsampwidth() * self.wav.getnchannels()))
+
+        # The mixer converts each chunk to its own format as it is loaded
+        data = io.BytesIO()
+        with wave.open(data, "wb") as chunk:
+            chunk.setparams(self.wav.getparams())
+            chunk.writeframes(frames)
+        data.seek(0)
+        sound = pygame.mixer.Sound(file=data)
+        sound.set_volume(self.volume)
+        return sound
+
+    def start(self):
+        self.channel.play(self.next_chunk())
+        self.channel.queue(self.next_chunk())
+
+    def update(self):
+        # After a stall longer than both buffered chunks the channel has gone idle, so it is started over
+        if not self.channel.get_busy():
+            self.start()
+        elif self.channel.get_queue() is None:
+            self.channel.queue(self.next_chunk())
+
+    def stop(self):
+        self.channel.stop()
+        self.wav.close()
+
+
+class AudioManager:
+    def __init__(self, sounds=SOUNDS, channels=MIXER_CHANNELS, cache_dir=CACHE_DIR):
+        self.sounds = sounds
+        self.cache_dir = cache_dir
+
+        # Channel 0 is kept for the ambience stream, the rest are sound effect voices
+        pygame.mixer.set_num_channels(channels)
+        pygame.mixer.set_reserved(1)
+        self.ambience_channel = pygame.mixer.Channel(0)
+        self.ambience = None
+        self.channels = [pygame.mixer.Channel(i) for i in range(1, channels)]
+        # (name, priority, play number) of the last sound started on each channel
+        self.voices = [None] * len(self.channels)
+        self.plays = 0
+
+        self.samples = {name: self.load_sample(name) for name in sounds}
+
+        # Sounds already started this frame, a second trigger of the same one is dropped
+        self.triggered = set()
+
+        self.music_track = None
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, "sfx_" + name + ".pcm")
+
+    def load_sample(self, name):
+        # Samples are kept on disk already converted to the mixer's format, keyed by source mtime
+        path, volume, cap, priority = self.sounds[name]
+        key = (SAMPLE_CACHE_MAGIC, SAMPLE_CACHE_VERSION, os.stat(path).st_mtime_ns) + tuple(pygame.mixer.get_init())
+
+        sound = None
+        try:
+            with open(self.cache_path(name), "rb") as f:
+                data = f.read()
+            if len(data) >= SAMPLE_CACHE_HEADER.size:
+                header = SAMPLE_CACHE_HEADER.unpack_from(data, 0)
+                if header[:-1] == key and len(data) == SAMPLE_CACHE_HEADER.size + header[-1]:
+                    sound = pygame.mixer.Sound(buffer=data[SAMPLE_CACHE_HEADER.size :])
+        except OSError:
+            pass
+
+        if sound is None:
+            sound = pygame.mixer.Sound(path)
+            raw = sound.get_raw()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(self.cache_path(name) + ".tmp", "wb") as f:
+                f.write(SAMPLE_CACHE_HEADER.pack(*key, len(raw)) + raw)
+            os.replace(self.cache_path(name) + ".tmp", self.cache_path(name))
+
+        sound.set_volume(volume)
+        return sound
+
+    def begin_frame(self):
+        self.triggered.clear()
+        if self.ambience:
+            self.ambience.update()
+
+    def start_ambience(self):
+        # Like music, ambience is optional and simply stays off without its file
+        if self.ambience is None and os.path.exists(AMBIENCE):
+            self.ambience = WavStream(AMBIENCE, self.ambience_channel, AMBIENCE_VOLUME)
+            self.ambience.start()
+
+    def music_for(self, level):
+        return find_track(os.path.join(MUSIC_DIR, str(level))) or find_track(DEFAULT_MUSIC)
+
+    def play_music(self, level, fade_ms=0):
+        # Keeps playing if the level uses the track that is already on
+        track = self.music_for(level)
+        if track is None or (track == self.music_track and pygame.mixer.music.get_busy()):
+            return
+
+        pygame.mixer.music.load(track)
+        pygame.mixer.music.set_volume(MUSIC_VOLUME)
+        pygame.mixer.music.play(-1, fade_ms=fade_ms)
+        self.music_track = track
+
+    def fade_music(self, level, fade_ms=MUSIC_FADE_MS):
+        # Fades out ahead of a level that plays a different track
+        if self.music_for(level) != self.music_track:
+            pygame.mixer.music.fadeout(fade_ms)
+
+    def play(self, name, loops=0):
+        if name in self.triggered:
+            return None
+        self.triggered.add(name)
+
+        path, volume, cap, priority = self.sounds[name]
+        busy = [i for i, channel in enumerate(self.channels) if channel.get_busy()]
+        own = [i for i in busy if self.voices[i][0] == name]
+        if len(own) >= cap:
+            # Restart the oldest voice of this sound
+            index = min(own, key=lambda i: self.voices[i][2])
+        elif len(busy) < len(self.channels):
+            index = next(i for i, channel in enumerate(self.channels) if not channel.get_busy())
+        else:
+            # Steal the oldest voice of the lowest priority sound, unless that outranks this one
+            index = min(busy, key=lambda i: (self.voices[i][1], self.voices[i][2]))
+            if self.voices[index][1] > priority:
+                return None
+
+        self.plays += 1
+        self.voices[index] = (name, priority, self.plays)
+        self.channels[index].play(self.samples[name], loops)
+        return self.channels[index]
+
+
+class NullAudio:
+    # Stands in for AudioManager in headless runs, nothing is loaded or played
+    def begin_frame(self):
+        pass
+
+    def start_ambience(self):
+        pass
+
+    def play_music(self, level, fade_ms=0):
+        pass
+
+    def fade_music(self, level, fade_ms=MUSIC_FADE_MS):
+        pass
+
+    def play(self, name, loops=0):
+        return None
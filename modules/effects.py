@@ -0,0 +1,39 @@
+import math
+import random
+
+# Effects shared by the Enemy reference path, the batched EnemySystem and the projectiles, so they can't drift apart.
+# They draw from the global random module in a fixed order, which replays depend on.
+
+
+def fan_sparks(game, pos, angle, count=4):
+    # A small spray of sparks around angle, for muzzle flashes and projectile impacts
+    for i in range(count):
+        game.sparks.add(pos, random.random() - 0.5 + angle, 2 + random.random())
+
+
+def burst(game, center):
+    # Sparks and particles flying out in every direction, whenever something dies
+    for i in range(30):
+        angle = random.random() * math.pi * 2
+        speed = random.random() * 5
+        game.sparks.add(center, angle, 2 + random.random())
+        game.particles.add(
+            "particle",
+            center,
+            velocity=[math.cos(angle + math.pi) * speed - 0.5, math.sin(angle + math.pi) * speed * 0.5],
+            frame=random.randint(0, 7),
+        )
+
+
+def enemy_shoot(game, muzzle, direction):
+    game.audio.play("shoot")
+    game.projectiles.add(muzzle, direction * 1.5)
+    fan_sparks(game, muzzle, math.pi if direction < 0 else 0)
+
+
+def enemy_killed(game, center):
+    game.screenshake = max(16, game.screenshake)
+    game.audio.play("hit")
+    burst(game, center)
+    game.sparks.add(center, 0, 5 + random.random())
+    game.sparks.add(center, math.pi, 5 + random.random())
@@ -0,0 +1,193 @@
+import random
+from array import array
+from modules.effects import enemy_shoot, enemy_killed
+
+ACTIONS = ("idle", "run")
+IDLE = 0
+RUN = 1
+
+# Enemies within this many pixels of the camera view update every frame
+ACTIVE_MARGIN = 96
+# Enemies further out only update once every SLEEP_INTERVAL frames, staggered by index
+SLEEP_INTERVAL = 8
+
+
+class EnemySystem:
+    def __init__(self, game, size=(8, 15)):
+        self.game = game
+        self.size = size
+        self.anim_offset = (-3, -3)
+        # (images, flipped images, frame duration, total frames, loop) per action
+        self.anims = None
+
+        # One array per enemy attribute, all indexed by enemy in spawn order
+        self.pos_x = array("d")
+        self.pos_y = array("d")
+        self.vel_y = array("d")
+        self.flip = bytearray()
+        # Hit a wall on the last update
+        self.blocked = bytearray()
+        self.walking = array("i")
+        self.action = bytearray()
+        self.frame = array("i")
+
+        # Updates so far, picks which sleeping enemies get their turn
+        self.ticks = 0
+
+    def __len__(self):
+        return len(self.pos_x)
+
+    def add(self, pos):
+        self.pos_x.append(pos[0])
+        self.pos_y.append(pos[1])
+        self.vel_y.append(0)
+        self.flip.append(False)
+        self.blocked.append(False)
+        self.walking.append(0)
+        self.action.append(IDLE)
+        self.frame.append(0)
+
+    def remove(self, i):
+        for slots in (self.pos_x, self.pos_y, self.vel_y, self.flip, self.blocked, self.walking, self.action, self.frame):
+            del slots[i]
+
+    def load_anims(self):
+        self.anims = []
+        for action in ACTIONS:
+            anim = self.game.assets["enemy/" + action]
+            self.anims.append((anim.images, anim.flipped_images, anim.img_duration, anim.img_duration * len(anim.images), anim.loop))
+
+    def update(self, tilemap, view=None):
+        # Same rules as Enemy.update, run for every enemy in one pass.
+        # With a view rect (x, y, w, h) only enemies near it are updated every frame.
+        if self.anims is None:
+            self.load_anims()
+
+        self.ticks += 1
+        if view is not None:
+            active_left = view[0] - ACTIVE_MARGIN
+            active_top = view[1] - ACTIVE_MARGIN
+            active_right = view[0] + view[2] + ACTIVE_MARGIN
+            active_bottom = view[1] + view[3] + ACTIVE_MARGIN
+
+        player = self.game.player
+        px, py = player.pos
+        player_rect = (int(px), int(py), int(px) + player.size[0], int(py) + player.size[1])
+        player_center = (int(px) + player.size[0] // 2, int(py) + player.size[1] // 2)
+        dash_kill = abs(player.dashing) >= 50
+        w, h = self.size
+        pos_x, pos_y, vel_y, flips, blocked, walking, actions, frames = (
+            self.pos_x,
+            self.pos_y,
+            self.vel_y,
+            self.flip,
+            self.blocked,
+            self.walking,
+            self.action,
+            self.frame,
+        )
+
+        killed = []
+        for i in range(len(pos_x)):
+            x = pos_x[i]
+            y = pos_y[i]
+            if view is not None and not (active_left <= x < active_right and active_top <= y < active_bottom) and (i + self.ticks) % SLEEP_INTERVAL:
+                continue
+
+            flip = flips[i]
+            movement = 0
+
+            # Walk until the ledge or a wall, then turn around and look for the player
+            if walking[i]:
+                if tilemap.solid_check((int(x) + w // 2 + (-7 if flip else 7), y + 23)):
+                    if blocked[i]:
+                        flip = not flip
+                    else:
+                        movement = -0.5 if flip else 0.5
+                else:
+                    flip = not flip
+
+                # Only shoot when no wall stands between the gun and the player
+                walking[i] -= 1
+                if not walking[i] and abs(py - y) < 16:
+                    if flip and px - x < 0:
+                        muzzle = (int(x) + w // 2 - 7, int(y) + h // 2)
+                        if tilemap.line_clear(muzzle, player_center):
+                            enemy_shoot(self.game, muzzle, -1)
+                    elif not flip and px - x > 0:
+                        muzzle = (int(x) + w // 2 + 7, int(y) + h // 2)
+                        if tilemap.line_clear(muzzle, player_center):
+                            enemy_shoot(self.game, muzzle, 1)
+
+            elif random.random() < 0.01:
+                walking[i] = random.randint(30, 120)
+
+            # Gravity and collisions
+            hit_wall = False
+            if movement:
+                x, hit_wall = tilemap.sweep((x, y), self.size, movement, 0)
+            vy = vel_y[i]
+            hit_floor = False
+            if vy:
+                y, hit_floor = tilemap.sweep((x, y), self.size, vy, 1)
+            vel_y[i] = 0 if hit_floor else min(5, vy + 0.1)
+            pos_x[i] = x
+            pos_y[i] = y
+            blocked[i] = hit_wall
+
+            if movement > 0:
+                flip = False
+            elif movement < 0:
+                flip = True
+            flips[i] = flip
+
+            # Animations restart whenever the action changes
+            action = RUN if movement else IDLE
+            if action != actions[i]:
+                actions[i] = action
+                frames[i] = 0
+            else:
+                images, flipped, img_dur, total, loop = self.anims[action]
+                frames[i] = (frames[i] + 1) % total if loop else min(frames[i] + 1, total - 1)
+
+            # Kill enemy with dash
+            if dash_kill:
+                left = int(x)
+                top = int(y)
+                if left < player_rect[2] and player_rect[0] < left + w and top < player_rect[3] and player_rect[1] < top + h:
+                    enemy_killed(self.game, (left + w // 2, top + h // 2))
+                    killed.append(i)
+
+        for i in reversed(killed):
+            self.remove(i)
+
+    def render(self, surf, offset=(0, 0)):
+        if self.anims is None:
+            self.load_anims()
+
+        gun = self.game.assets["gun"]
+        gun_flipped = self.game.assets["gun/flipped"]
+        w, h = self.size
+        # Skip enemies whose sprite and gun can't reach the surface
+        reach = max(max(images[0].get_size()) for images, flipped, img_dur, total, loop in self.anims) + gun.get_width() + w
+        cull_left = offset[0] - reach
+        cull_top = offset[1] - reach
+        cull_right = offset[0] + surf.get_width() + reach
+        cull_bottom = offset[1] + surf.get_height() + reach
+        blits = []
+        for x, y, flip, action, frame in zip(self.pos_x, self.pos_y, self.flip, self.action, self.frame):
+            if not (cull_left <= x < cull_right and cull_top <= y < cull_bottom):
+                continue
+
+            images, flipped, img_dur, total, loop = self.anims[action]
+            img = (flipped if flip else images)[int(frame / img_dur)]
+            blits.append((img, (x - offset[0] + self.anim_offset[0], y - offset[1] + self.anim_offset[1])))
+
+            centerx = int(x) + w // 2
+            centery = int(y) + h // 2
+            if flip:
+                blits.append((gun_flipped, (centerx - 4 - gun.get_width() - offset[0], centery - offset[1])))
+            else:
+                blits.append((gun, (centerx + 4 - offset[0], centery - offset[1])))
+
+        surf.blits(blits, doreturn=False)
@@ -1,8 +1,7 @@
 import math
 import pygame
 import random
-from modules.particles import Particle
-from modules.sparks import Spark
+from modules.effects import enemy_shoot, enemy_killed
 
 
 class PhysicsEntity:
@@ -39,32 +38,16 @@ class PhysicsEntity:
         )
 
         # --- Handle x axis movements ---
-        self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for rect in tilemap.phsysics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[0] > 0:
-                    entity_rect.right = rect.left
-                    self.collisions["right"] = True
-                elif frame_movement[0] < 0:
-                    entity_rect.left = rect.right
-                    self.collisions["left"] = True
-
-                self.pos[0] = entity_rect.x
+        if frame_movement[0]:
+            self.pos[0], hit = tilemap.sweep(self.pos, self.size, frame_movement[0], 0)
+            if hit:
+                self.collisions["right" if frame_movement[0] > 0 else "left"] = True
 
         # --- Handle y axis movements ---
-        self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for rect in tilemap.phsysics_rects_around(self.pos):
-            if entity_rect.colliderect(rect):
-                if frame_movement[1] > 0:
-                    entity_rect.bottom = rect.top
-                    self.collisions["down"] = True
-                elif frame_movement[1] < 0:
-                    entity_rect.top = rect.bottom
-                    self.collisions["up"] = True
-
-                self.pos[1] = entity_rect.y
+        if frame_movement[1]:
+            self.pos[1], hit = tilemap.sweep(self.pos, self.size, frame_movement[1], 1)
+            if hit:
+                self.collisions["down" if frame_movement[1] > 0 else "up"] = True
 
         # --- Velocity ---
         self.velocity[1] = min(5, self.velocity[1] + 0.1)
@@ -84,7 +67,7 @@ class PhysicsEntity:
 
     def render(self, surf, offset=(0, 0)):
         surf.blit(
-            pygame.transform.flip(self.animation.img(), self.flip, False),
+            self.animation.img(self.flip),
             (
                 self.pos[0] - offset[0] + self.anim_offset[0],
                 self.pos[1] - offset[1] + self.anim_offset[1],
@@ -117,18 +100,17 @@ class Enemy(PhysicsEntity):
                     self.game.player.pos[0] - self.pos[0],
                     self.game.player.pos[1] - self.pos[1],
                 )
+                # Only shoot when no wall stands between the gun and the player
                 if abs(distance[1]) < 16:
                     if self.flip and distance[0] < 0:
-                        self.game.sfx["shoot"].play()
-                        self.game.projectiles.append([[self.rect().centerx - 7, self.rect().centery], -1.5, 0])
-                        for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1][0], random.random() - 0.5 + math.pi, 2 + random.random()))
+                        muzzle = (self.rect().centerx - 7, self.rect().centery)
+                        if tilemap.line_clear(muzzle, self.game.player.rect().center):
+                            enemy_shoot(self.game, muzzle, -1)
 
                     elif not self.flip and distance[0] > 0:
-                        self.game.sfx["shoot"].play()
-                        self.game.projectiles.append([[self.rect().centerx + 7, self.rect().centery], 1.5, 0])
-                        for i in range(4):
-                            self.game.sparks.append(Spark(self.game.projectiles[-1][0], random.random() - 0.5, 2 + random.random()))
+                        muzzle = (self.rect().centerx + 7, self.rect().centery)
+                        if tilemap.line_clear(muzzle, self.game.player.rect().center):
+                            enemy_shoot(self.game, muzzle, 1)
 
         elif random.random() < 0.01:
             self.walking = random.randint(30, 120)
@@ -142,24 +124,7 @@ class Enemy(PhysicsEntity):
 
         # Kill enemy with dash
         if abs(self.game.player.dashing) >= 50 and self.rect().colliderect(self.game.player.rect()):
-            self.game.screenshake = max(16, self.game.screenshake)
-            self.game.sfx["hit"].play()
-            for i in range(30):
-                angle = random.random() * math.pi * 2
-                speed = random.random() * 5
-                self.game.sparks.append(Spark(self.rect().center, angle, 2 + random.random()))
-                self.game.particles.append(
-                    Particle(
-                        self.game,
-                        "particle",
-                        self.rect().center,
-                        velocity=[math.cos(angle + math.pi) * speed - 0.5, math.sin(angle + math.pi) * speed * 0.5],
-                        frame=random.randint(0, 7),
-                    )
-                )
-
-            self.game.sparks.append(Spark(self.rect().center, 0, 5 + random.random()))
-            self.game.sparks.append(Spark(self.rect().center, math.pi, 5 + random.random()))
+            enemy_killed(self.game, self.rect().center)
             return True
 
     def render(self, surf, offset=(0, 0)):
@@ -167,7 +132,7 @@ class Enemy(PhysicsEntity):
 
         if self.flip:
             surf.blit(
-                pygame.transform.flip(self.game.assets["gun"], True, False),
+                self.game.assets["gun/flipped"],
                 (
                     self.rect().centerx - 4 - self.game.assets["gun"].get_width() - offset[0],
                     self.rect().centery - offset[1],
@@ -229,28 +194,22 @@ class Player(PhysicsEntity):
                 self.velocity[0] *= 0.1
 
             pvelocity = [abs(self.dashing) / self.dashing * random.random() * 3, 0]
-            self.game.particles.append(
-                Particle(
-                    self.game,
-                    "particle",
-                    self.rect().center,
-                    velocity=pvelocity,
-                    frame=random.randint(0, 7),
-                )
+            self.game.particles.add(
+                "particle",
+                self.rect().center,
+                velocity=pvelocity,
+                frame=random.randint(0, 7),
             )
         if abs(self.dashing) in {60, 50}:
             for i in range(20):
                 angle = random.random() * math.pi * 2
                 speed = random.random() * 0.5 + 0.5
                 pvelocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                self.game.particles.append(
-                    Particle(
-                        self.game,
-                        "particle",
-                        self.rect().center,
-                        velocity=pvelocity,
-                        frame=random.randint(0, 7),
-                    )
+                self.game.particles.add(
+                    "particle",
+                    self.rect().center,
+                    velocity=pvelocity,
+                    frame=random.randint(0, 7),
                 )
 
         if self.dashing > 0:
@@ -274,14 +233,14 @@ class Player(PhysicsEntity):
             elif not self.flip and self.last_movement[0] > 0:
                 self.velocity[0] = -3.5
 
-            self.game.sfx["jump"].play()
+            self.game.audio.play("jump")
             self.velocity[1] = -2.5
             self.air_time = 5
             self.jumps = max(0, self.jumps - 1)
             return True
 
         elif self.jumps:
-            self.game.sfx["jump"].play()
+            self.game.audio.play("jump")
             self.velocity[1] = -3
             self.jumps -= 1
             self.air_time = 5
@@ -289,7 +248,7 @@ class Player(PhysicsEntity):
 
     def dash(self):
         if not self.dashing:
-            self.game.sfx["dash"].play()
+            self.game.audio.play("dash")
             if self.flip:
                 self.dashing = -60
             else:
@@ -0,0 +1,26 @@
+import pygame
+
+
+class LevelTemplate:
+    # A level as it starts, read and scanned once, then shared by every respawn
+    def __init__(self, tilemap, map_id, path, map_data=None):
+        self.map_id = map_id
+
+        tilemap.load(path, map_data)
+        # Enemies check sight lines against per-row solid runs, so build them all now
+        tilemap.build_solid_runs()
+        self.leaf_spawners = tuple(
+            pygame.Rect(4 + tree["pos"][0], 4 + tree["pos"][1], 23, 13) for tree in tilemap.extract([("large_decor", 2)], keep=True)
+        )
+
+        self.player_spawn = None
+        enemy_spawns = []
+        for spawner in tilemap.extract([("spawners", 0), ("spawners", 1)]):
+            if spawner["variant"] == 0:
+                self.player_spawn = tuple(spawner["pos"])
+            else:
+                enemy_spawns.append(tuple(spawner["pos"]))
+        self.enemy_spawns = tuple(enemy_spawns)
+
+        # Taken after the spawners are pulled out, so respawns skip both scans
+        self.tiles = tilemap.snapshot()
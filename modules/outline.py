@@ -0,0 +1,30 @@
+import pygame
+
+OUTLINE_OFFSETS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+
+class Outline:
+    def __init__(self, size, color=(0, 0, 0, 180)):
+        self.color = color
+
+        # Reused every frame instead of building a mask and a new surface
+        self.silhouette = pygame.Surface(size, pygame.SRCALPHA)
+        self.composite = pygame.Surface(size)
+        self.last_scene = None
+
+    def render(self, scene, surf, background):
+        # Draws background plus a drop outline of scene's opaque pixels onto surf
+        pixels = scene.get_buffer().raw
+
+        if pixels != self.last_scene:
+            # Scaling the fill color's alpha by the scene's alpha gives the silhouette
+            self.silhouette.fill(self.color)
+            self.silhouette.blit(scene, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+
+            self.composite.blit(background, (0, 0))
+            for offset in OUTLINE_OFFSETS:
+                self.composite.blit(self.silhouette, offset)
+
+            self.last_scene = pixels
+
+        surf.blit(self.composite, (0, 0))
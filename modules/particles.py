@@ -1,30 +1,78 @@
-class Particle:
-    def __init__(self, game, p_type, pos, velocity=[0, 0], frame=0):
+import math
+
+# Particle types that drift side to side as they fall
+SWAY_TYPES = {"leaf"}
+
+
+class ParticleSystem:
+    def __init__(self, game):
         self.game = game
-        self.type = p_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.animation = self.game.assets["particle/" + p_type].copy()
-        self.animation.frame = frame
+        self.anims = {}
+
+        # One list per particle attribute, all indexed by particle
+        self.types = []
+        self.pos_x = []
+        self.pos_y = []
+        self.vel_x = []
+        self.vel_y = []
+        self.frames = []
+        self.done = []
+
+        # (image, x, y) in world space from the last update
+        self.draws = []
+
+    def __len__(self):
+        return len(self.types)
+
+    def add(self, p_type, pos, velocity=[0, 0], frame=0):
+        if p_type not in self.anims:
+            anim = self.game.assets["particle/" + p_type]
+            self.anims[p_type] = (anim.images, anim.img_duration, anim.img_duration * len(anim.images), anim.loop)
+
+        self.types.append(p_type)
+        self.pos_x.append(pos[0])
+        self.pos_y.append(pos[1])
+        self.vel_x.append(velocity[0])
+        self.vel_y.append(velocity[1])
+        self.frames.append(frame)
+        self.done.append(False)
 
     def update(self):
-        kill = False
-        if self.animation.done:
-            kill = True
+        # Particles whose animation finished last frame still move and draw once more
+        kill = self.done
+
+        self.pos_x = [x + vx for x, vx in zip(self.pos_x, self.vel_x)]
+        self.pos_y = [y + vy for y, vy in zip(self.pos_y, self.vel_y)]
+
+        frames = []
+        done = []
+        draws = []
+        anims = self.anims
+        for i, (p_type, frame) in enumerate(zip(self.types, self.frames)):
+            images, img_dur, total, loop = anims[p_type]
+            if loop:
+                frame = (frame + 1) % total
+                done.append(False)
+            else:
+                frame = min(frame + 1, total - 1)
+                done.append(frame >= total - 1)
+            frames.append(frame)
+
+            img = images[int(frame / img_dur)]
+            half = img.get_width() // 2
+            draws.append((img, self.pos_x[i] - half, self.pos_y[i] - half))
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
+            if p_type in SWAY_TYPES:
+                self.pos_x[i] += math.sin(frame * 0.035) * 0.35
 
-        self.animation.update()
+        self.frames = frames
+        self.done = done
+        self.draws = draws
 
-        return kill
+        # Compact away killed particles with the kill mask
+        if any(kill):
+            for name in ("types", "pos_x", "pos_y", "vel_x", "vel_y", "frames", "done"):
+                setattr(self, name, [value for value, dead in zip(getattr(self, name), kill) if not dead])
 
     def render(self, surf, offset=(0, 0)):
-        img = self.animation.img()
-        surf.blit(
-            img,
-            (
-                self.pos[0] - offset[0] - img.get_width() // 2,
-                self.pos[1] - offset[1] - img.get_width() // 2,
-            ),
-        )
+        surf.blits([(img, (x - offset[0], y - offset[1])) for img, x, y in self.draws], doreturn=False)
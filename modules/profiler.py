@@ -0,0 +1,126 @@
+import csv
+import json
+import time
+import pygame
+from collections import deque
+
+PERCENTILES = (50, 95, 99)
+
+
+class Profiler:
+    def __init__(self, history=600):
+        self.history = history
+        self.frames = 0
+
+        # Rolling per-section timings in ms, plus whole-run [count, total] pairs
+        self.samples = {}
+        self.totals = {}
+
+        self.current = {}
+        self.frame_start = 0
+        self.last = 0
+
+        self.overlay = False
+        self.overlay_lines = []
+        self.font = None
+
+    def begin_frame(self):
+        self.current = {}
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, name):
+        # Charge the time since the previous lap to this section
+        now = time.perf_counter()
+        self.current[name] = self.current.get(name, 0) + (now - self.last) * 1000
+        self.last = now
+
+    def end_frame(self):
+        self.current["frame"] = (time.perf_counter() - self.frame_start) * 1000
+
+        # Sections that were skipped this frame still get a sample so rows line up
+        for name in self.samples:
+            if name not in self.current:
+                self.current[name] = 0
+
+        for name, ms in self.current.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.history)
+                self.totals[name] = [0, 0]
+            self.samples[name].append(ms)
+            self.totals[name][0] += 1
+            self.totals[name][1] += ms
+
+        self.frames += 1
+
+    def percentile(self, name, pct):
+        samples = sorted(self.samples[name])
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def summary(self):
+        stats = {}
+        for name in self.samples:
+            stats[name] = {
+                "count": self.totals[name][0],
+                "mean_ms": self.totals[name][1] / self.totals[name][0],
+                "max_ms": max(self.samples[name]),
+            }
+            for pct in PERCENTILES:
+                stats[name]["p" + str(pct) + "_ms"] = self.percentile(name, pct)
+
+        return stats
+
+    def render_overlay(self, surf):
+        if not self.overlay or not self.frames:
+            return
+
+        # Text is only re-rendered every half second or so
+        if not self.overlay_lines or self.frames % 30 == 0:
+            if not self.font:
+                self.font = pygame.font.Font(None, 16)
+
+            self.overlay_lines = []
+            for name in sorted(self.samples, key=lambda name: -self.percentile(name, 50)):
+                text = name + "  p50 " + format(self.percentile(name, 50), ".2f") + "  p99 " + format(self.percentile(name, 99), ".2f")
+                self.overlay_lines.append(self.font.render(text, True, (255, 255, 255), (0, 0, 0)))
+
+        surf.blits([(line, (4, 4 + i * 12)) for i, line in enumerate(self.overlay_lines)], doreturn=False)
+
+    def dump(self, path):
+        # JSON gets the summary, CSV gets one row per frame in the rolling window
+        if path.endswith(".csv"):
+            names = sorted(self.samples)
+            rows = len(self.samples["frame"]) if "frame" in self.samples else 0
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(names)
+                for row in range(rows):
+                    # Sections first seen part way through are padded at the front
+                    writer.writerow([self.sample_at(name, row, rows) for name in names])
+        else:
+            with open(path, "w") as f:
+                json.dump({"frames": self.frames, "sections": self.summary()}, f, indent=2)
+
+    def sample_at(self, name, row, rows):
+        samples = self.samples[name]
+        i = row - (rows - len(samples))
+        return format(samples[i], ".4f") if i >= 0 else ""
+
+
+class NullProfiler:
+    # Stands in for Profiler when profiling is off, so every hook is a no-op
+    overlay = False
+
+    def begin_frame(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def render_overlay(self, surf):
+        pass
+
+    def dump(self, path):
+        pass
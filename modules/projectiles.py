@@ -0,0 +1,85 @@
+import math
+from array import array
+from modules.effects import fan_sparks
+
+# Frames a projectile flies before it fizzles out
+MAX_LIFETIME = 360
+
+
+class ProjectileSystem:
+    def __init__(self, game, capacity=64):
+        self.game = game
+
+        # Fixed-capacity slots, live projectiles packed at the front in firing order
+        self.capacity = capacity
+        self.count = 0
+        self.pos_x = array("d", bytes(8 * capacity))
+        self.pos_y = array("d", bytes(8 * capacity))
+        self.speed = array("d", bytes(8 * capacity))
+        self.timer = array("i", bytes(4 * capacity))
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        # (x, y) of every live projectile
+        return zip(self.pos_x[: self.count], self.pos_y[: self.count])
+
+    def add(self, pos, speed):
+        if self.count == self.capacity:
+            for slots in (self.pos_x, self.pos_y, self.speed):
+                slots.extend(array("d", bytes(8 * self.capacity)))
+            self.timer.extend(array("i", bytes(4 * self.capacity)))
+            self.capacity *= 2
+
+        i = self.count
+        self.pos_x[i] = pos[0]
+        self.pos_y[i] = pos[1]
+        self.speed[i] = speed
+        self.timer[i] = 0
+        self.count += 1
+
+    def update(self, tilemap):
+        n = self.count
+        if not n:
+            return
+
+        # Move and age every projectile, then look up all their tiles at once
+        pos_x = array("d", [x + speed for x, speed in zip(self.pos_x[:n], self.speed[:n])])
+        timer = array("i", [t + 1 for t in self.timer[:n]])
+        pos_y = self.pos_y[:n]
+        solid = tilemap.solid_points(pos_x, pos_y)
+
+        game = self.game
+        player = game.player
+        if abs(player.dashing) < 50:
+            left = int(player.pos[0])
+            top = int(player.pos[1])
+            right = left + player.size[0]
+            bottom = top + player.size[1]
+        else:
+            left = top = right = bottom = 0
+
+        # Compact survivors to the front, keeping their order
+        live = 0
+        for i in range(n):
+            x = pos_x[i]
+            y = pos_y[i]
+            if solid[i] or timer[i] > MAX_LIFETIME:
+                fan_sparks(game, (x, y), math.pi if self.speed[i] > 0 else 0)
+            elif left <= int(x) < right and top <= int(y) < bottom:
+                game.hit_player()
+            else:
+                self.pos_x[live] = x
+                self.pos_y[live] = y
+                self.speed[live] = self.speed[i]
+                self.timer[live] = timer[i]
+                live += 1
+
+        self.count = live
+
+    def render(self, surf, offset=(0, 0)):
+        img = self.game.assets["projectile"]
+        half_w = img.get_width() / 2
+        half_h = img.get_height() / 2
+        surf.blits([(img, (x - half_w - offset[0], y - half_h - offset[1])) for x, y in self], doreturn=False)
@@ -0,0 +1,50 @@
+import struct
+import zlib
+
+# Replay layout, little endian: header, then one input byte per frame, zlib compressed
+REPLAY_MAGIC = b"NRPL"
+REPLAY_VERSION = 1
+# The seed is signed, --seed takes negative numbers too
+REPLAY_HEADER = struct.Struct("<4sHIq")
+
+INPUT_BITS = {"left": 1, "right": 2, "jump": 4, "dash": 8}
+
+
+class Replay:
+    # A play session as the RNG seed it started from and the inputs fed to each Game.step
+    def __init__(self, seed, frames=b""):
+        # Checked up front, a seed the header can't hold would otherwise only fail on save at exit
+        if not -(1 << 63) <= seed < 1 << 63:
+            raise ValueError("replay seed " + str(seed) + " does not fit in 64 bits")
+        self.seed = seed
+        self.frames = bytearray(frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def record(self, inputs):
+        bits = 0
+        for action in inputs:
+            bits |= INPUT_BITS[action]
+        self.frames.append(bits)
+
+    def inputs(self):
+        for bits in self.frames:
+            yield {action for action, bit in INPUT_BITS.items() if bits & bit}
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, len(self.frames), self.seed))
+            f.write(zlib.compress(bytes(self.frames), 9))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, version, frame_count, seed = REPLAY_HEADER.unpack(f.read(REPLAY_HEADER.size))
+            if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+                raise ValueError(path + " is not a version " + str(REPLAY_VERSION) + " replay")
+            frames = zlib.decompress(f.read())
+
+        if len(frames) != frame_count:
+            raise ValueError(path + " is truncated")
+        return cls(seed, frames)
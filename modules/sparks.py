@@ -1,38 +1,79 @@
 import math
 import pygame
+from array import array
 
 
-class Spark:
-    def __init__(self, pos, angle, speed):
-        self.pos = list(pos)
-        self.angle = angle
-        self.speed = speed
+class SparkSystem:
+    def __init__(self, capacity=64):
+        # Fixed-capacity slots, live sparks packed at the front
+        self.capacity = capacity
+        self.count = 0
+        self.pos_x = array("d", bytes(8 * capacity))
+        self.pos_y = array("d", bytes(8 * capacity))
+        self.cos = array("d", bytes(8 * capacity))
+        self.sin = array("d", bytes(8 * capacity))
+        self.speed = array("d", bytes(8 * capacity))
+
+        # Slots that died on the last update, freed on the next one
+        self.dead = []
+
+    def __len__(self):
+        return self.count - len(self.dead)
+
+    def add(self, pos, angle, speed):
+        if self.count == self.capacity:
+            for slots in (self.pos_x, self.pos_y, self.cos, self.sin, self.speed):
+                slots.extend(array("d", bytes(8 * self.capacity)))
+            self.capacity *= 2
+
+        i = self.count
+        self.pos_x[i] = pos[0]
+        self.pos_y[i] = pos[1]
+        # The angle never changes, so only work out its direction once
+        self.cos[i] = math.cos(angle)
+        self.sin[i] = math.sin(angle)
+        self.speed[i] = speed
+        self.count += 1
+
+    def free(self, i):
+        # Move the last live spark into the freed slot
+        last = self.count - 1
+        for slots in (self.pos_x, self.pos_y, self.cos, self.sin, self.speed):
+            slots[i] = slots[last]
+        self.count = last
 
     def update(self):
-        self.pos[0] += math.cos(self.angle) * self.speed
-        self.pos[1] += math.sin(self.angle) * self.speed
+        for i in reversed(self.dead):
+            self.free(i)
 
-        self.speed = max(0, self.speed - 0.1)
-        return not self.speed
+        pos_x, pos_y, cos, sin, speeds = self.pos_x, self.pos_y, self.cos, self.sin, self.speed
+        dead = []
+        for i in range(self.count):
+            speed = speeds[i]
+            pos_x[i] += cos[i] * speed
+            pos_y[i] += sin[i] * speed
+
+            speed = max(0, speed - 0.1)
+            speeds[i] = speed
+            if not speed:
+                dead.append(i)
+
+        self.dead = dead
 
     def render(self, surf, offset=(0, 0)):
-        render_points = [
-            (
-                self.pos[0] + math.cos(self.angle) * self.speed * 3 - offset[0],
-                self.pos[1] + math.sin(self.angle) * self.speed * 3 - offset[1],
-            ),
-            (
-                self.pos[0] + math.cos(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[0],
-                self.pos[1] + math.sin(self.angle + math.pi * 0.5) * self.speed * 0.5 - offset[1],
-            ),
-            (
-                self.pos[0] + math.cos(self.angle + math.pi) * self.speed * 3 - offset[0],
-                self.pos[1] + math.sin(self.angle + math.pi) * self.speed * 3 - offset[1],
-            ),
-            (
-                self.pos[0] + math.cos(self.angle - math.pi * 0.5) * self.speed * 0.5 - offset[0],
-                self.pos[1] + math.sin(self.angle - math.pi * 0.5) * self.speed * 0.5 - offset[1],
-            ),
-        ]
-
-        pygame.draw.polygon(surf, (255, 255, 255), render_points)
+        pos_x, pos_y, cos, sin, speeds = self.pos_x, self.pos_y, self.cos, self.sin, self.speed
+        for i in range(self.count):
+            x = pos_x[i] - offset[0]
+            y = pos_y[i] - offset[1]
+            dx = cos[i] * speeds[i]
+            dy = sin[i] * speeds[i]
+
+            # Long points along the angle, short points perpendicular to it
+            render_points = [
+                (x + dx * 3, y + dy * 3),
+                (x - dy * 0.5, y + dx * 0.5),
+                (x - dx * 3, y - dy * 3),
+                (x + dy * 0.5, y - dx * 0.5),
+            ]
+
+            pygame.draw.polygon(surf, (255, 255, 255), render_points)
@@ -1,6 +1,10 @@
-import os
 import json
+import math
+import mmap
+import struct
 import pygame
+from bisect import bisect_left, bisect_right, insort
+from array import array
 
 NEIGHBOR_OFFSETS = [
     (-1, 0),
@@ -29,32 +33,420 @@ AUTOTILE_MAP = {
     tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
 }
 
+# Grid tiles live in square chunks of CHUNK_SIZE x CHUNK_SIZE cells
+CHUNK_SHIFT = 4
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Type ids are stored one unsigned byte per cell, with the top value kept for empty cells
+EMPTY = 255
+MAX_TILE_TYPES = EMPTY
+
+# Maximum number of baked chunk surfaces kept around at once
+CHUNK_CACHE_SIZE = 64
+
+# Compiled map layout, all little endian:
+#   header, type name table (u8 length + utf-8 name each, grid types first),
+#   chunk records (header + CHUNK_SIZE^2 type ids + CHUNK_SIZE^2 variants),
+#   offgrid records, spawner records
+MAP_MAGIC = b"NMAP"
+MAP_VERSION = 1
+MAP_HEADER = struct.Struct("<4sHHHHIII")
+CHUNK_HEADER = struct.Struct("<iiH2x")
+OFFGRID_RECORD = struct.Struct("<ddHH4x")
+COMPILED_EXTENSION = ".map"
+
+SPAWNER_TYPE = "spawners"
+
+
+def compiled_map_ok(path):
+    # Whether a compiled map was written in the format this build reads
+    try:
+        with open(path, "rb") as f:
+            header = f.read(MAP_HEADER.size)
+    except OSError:
+        return False
+    if len(header) != MAP_HEADER.size:
+        return False
+    magic, version, tile_size, grid_type_count, type_count = MAP_HEADER.unpack(header)[:5]
+    return magic == MAP_MAGIC and version == MAP_VERSION and grid_type_count <= min(type_count, MAX_TILE_TYPES)
+
+
+def load_map_data(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def map_tile_types(path, map_data=None):
+    # Every tile type a map file uses. A compiled map only has its header read,
+    # a JSON map is parsed in full unless its parsed data is passed in.
+    if path.endswith(COMPILED_EXTENSION):
+        with open(path, "rb") as f:
+            header = f.read(MAP_HEADER.size)
+            tile_types = set()
+            for t in range(MAP_HEADER.unpack(header)[4]):
+                tile_types.add(f.read(f.read(1)[0]).decode("utf-8"))
+        return tile_types
+
+    if map_data is None:
+        map_data = load_map_data(path)
+    return {tile["type"] for tile in map_data["tilemap"].values()} | {tile["type"] for tile in map_data["offgrid"]}
+
+
+class TileChunk:
+    def __init__(self):
+        # Type ids (EMPTY for no tile), variants and a solidity flag per cell
+        self.types = array("B", [EMPTY]) * (CHUNK_SIZE * CHUNK_SIZE)
+        self.variants = array("B", bytes(CHUNK_SIZE * CHUNK_SIZE))
+        self.solid = bytearray(CHUNK_SIZE * CHUNK_SIZE)
+        self.count = 0
+
+    def copy(self):
+        chunk = TileChunk()
+        chunk.types = array("B", self.types)
+        chunk.variants = array("B", self.variants)
+        chunk.solid = bytearray(self.solid)
+        chunk.count = self.count
+        return chunk
+
 
 class Tilemap:
     def __init__(self, game, tile_size=16):
         self.game = game
         self.tile_size = tile_size
-        self.tilemap = {}
+        self.chunks = {}
         self.offgrid_tiles = []
 
+        # Bumped on every change, so snapshots can tell whether they need restoring
+        self.revision = 0
+
+        # Offgrid tiles bucketed by the chunk holding their top left corner,
+        # and by (type, variant), as (sequence, tile) entries in draw order
+        self.offgrid_index = {}
+        self.offgrid_types = {}
+        self.offgrid_seq = 0
+        self.offgrid_margin = None
+
+        # Tile type names are interned to small integer ids
+        self.tile_types = []
+        self.type_ids = {}
+        self.solid_types = []
+        # Grid cells holding each type, only types with tiles left count towards the overhang
+        self.type_counts = []
+
+        # Baked chunk surfaces, in least recently used order
+        self.chunk_surfaces = {}
+        self.overhang = None
+
+        # Merged [start, end) runs of solid cells per row and per column, built on demand
+        self.solid_rows = {}
+        self.solid_cols = {}
+        # Sorted chunk x per chunk row and chunk y per chunk column, so runs never scan every chunk
+        self.chunk_rows = {}
+        self.chunk_cols = {}
+
+    def type_id(self, tile_type):
+        if tile_type not in self.type_ids:
+            if len(self.tile_types) >= MAX_TILE_TYPES:
+                raise ValueError("a tilemap holds at most " + str(MAX_TILE_TYPES) + " grid tile types")
+            self.type_ids[tile_type] = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            self.solid_types.append(tile_type in PHYSICS_TILES)
+            self.type_counts.append(0)
+
+        return self.type_ids[tile_type]
+
+    def count_types(self):
+        self.type_counts = [sum(chunk.types.count(t_id) for chunk in self.chunks.values()) for t_id in range(len(self.tile_types))]
+        self.overhang = None
+
+    def add_type_count(self, t_id, delta):
+        self.type_counts[t_id] += delta
+        if self.type_counts[t_id] == (1 if delta > 0 else 0):
+            self.overhang = None
+
+    def clear(self):
+        self.revision += 1
+        self.chunks = {}
+        self.offgrid_tiles = []
+        self.offgrid_index = {}
+        self.offgrid_types = {}
+        self.offgrid_margin = None
+        self.chunk_surfaces = {}
+        self.type_counts = [0] * len(self.tile_types)
+        self.overhang = None
+        self.solid_rows = {}
+        self.solid_cols = {}
+        self.chunk_rows = {}
+        self.chunk_cols = {}
+
+    def index_chunks(self):
+        self.chunk_rows = {}
+        self.chunk_cols = {}
+        for cx, cy in self.chunks:
+            self.chunk_rows.setdefault(cy, []).append(cx)
+            self.chunk_cols.setdefault(cx, []).append(cy)
+        for chunk_line in list(self.chunk_rows.values()) + list(self.chunk_cols.values()):
+            chunk_line.sort()
+
+    def add_chunk(self, cx, cy, chunk):
+        self.chunks[(cx, cy)] = chunk
+        insort(self.chunk_rows.setdefault(cy, []), cx)
+        insort(self.chunk_cols.setdefault(cx, []), cy)
+
+    def remove_chunk(self, cx, cy):
+        del self.chunks[(cx, cy)]
+        for lines, line, pos in ((self.chunk_rows, cy, cx), (self.chunk_cols, cx, cy)):
+            chunk_line = lines[line]
+            del chunk_line[bisect_left(chunk_line, pos)]
+            if not chunk_line:
+                del lines[line]
+
+    def grid_overhang(self):
+        # How many extra tiles the largest grid tile image reaches right and down
+        if self.overhang is None:
+            overhang = [0, 0]
+            for tile_type, count in zip(self.tile_types, self.type_counts):
+                if not count:
+                    continue
+                for img in self.game.assets[tile_type]:
+                    overhang[0] = max(overhang[0], (img.get_width() - 1) // self.tile_size)
+                    overhang[1] = max(overhang[1], (img.get_height() - 1) // self.tile_size)
+            self.overhang = tuple(overhang)
+
+        return self.overhang
+
+    def mark_dirty(self, rect):
+        # Drops the baked surfaces of every chunk overlapping a pixel rect
+        if not self.chunk_surfaces:
+            return
+
+        chunk_px = CHUNK_SIZE * self.tile_size
+        for cx in range(rect[0] // chunk_px, (rect[0] + rect[2] - 1) // chunk_px + 1):
+            for cy in range(rect[1] // chunk_px, (rect[1] + rect[3] - 1) // chunk_px + 1):
+                self.chunk_surfaces.pop((cx, cy), None)
+
+    def mark_tile_dirty(self, x, y):
+        self.solid_rows.pop(y, None)
+        self.solid_cols.pop(x, None)
+
+        if self.chunk_surfaces:
+            overhang = self.grid_overhang()
+            self.mark_dirty(
+                (
+                    x * self.tile_size,
+                    y * self.tile_size,
+                    (overhang[0] + 1) * self.tile_size,
+                    (overhang[1] + 1) * self.tile_size,
+                )
+            )
+
+    def offgrid_rect(self, tile):
+        img = self.game.assets[tile["type"]][tile["variant"]]
+        return pygame.Rect(math.floor(tile["pos"][0]), math.floor(tile["pos"][1]), img.get_width(), img.get_height())
+
+    def offgrid_bucket(self, tile):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        return (math.floor(tile["pos"][0]) // chunk_px, math.floor(tile["pos"][1]) // chunk_px)
+
+    def offgrid_extent(self):
+        # Size of the largest offgrid tile image, so queries can reach into neighbouring buckets
+        if self.offgrid_margin is None:
+            margin = [0, 0]
+            for (tile_type, variant), entries in self.offgrid_types.items():
+                if not entries:
+                    continue
+                img = self.game.assets[tile_type][variant]
+                margin[0] = max(margin[0], img.get_width())
+                margin[1] = max(margin[1], img.get_height())
+            self.offgrid_margin = tuple(margin)
+
+        return self.offgrid_margin
+
+    def add_offgrid(self, tile):
+        self.revision += 1
+        self.offgrid_seq += 1
+        entry = (self.offgrid_seq, tile)
+        self.offgrid_tiles.append(tile)
+        self.offgrid_index.setdefault(self.offgrid_bucket(tile), []).append(entry)
+        entries = self.offgrid_types.setdefault((tile["type"], tile["variant"]), [])
+        if not entries:
+            self.offgrid_margin = None
+        entries.append(entry)
+
+        if self.chunk_surfaces:
+            self.mark_dirty(self.offgrid_rect(tile))
+
+    def remove_offgrid(self, tile):
+        self.remove_offgrids([tile])
+
+    def remove_offgrids(self, tiles):
+        # Tiles are matched by identity, and every list they sit in is compacted once however many go
+        if not tiles:
+            return
+
+        self.revision += 1
+        removed = {id(tile) for tile in tiles}
+        self.offgrid_tiles = [tile for tile in self.offgrid_tiles if id(tile) not in removed]
+        for index, keys in (
+            (self.offgrid_index, {self.offgrid_bucket(tile) for tile in tiles}),
+            (self.offgrid_types, {(tile["type"], tile["variant"]) for tile in tiles}),
+        ):
+            for key in keys:
+                index[key] = [entry for entry in index[key] if id(entry[1]) not in removed]
+                if not index[key]:
+                    self.offgrid_margin = None
+
+        if self.chunk_surfaces:
+            for tile in tiles:
+                self.mark_dirty(self.offgrid_rect(tile))
+
+    def offgrid_in_rect(self, rect):
+        # Offgrid tiles overlapping a pixel rect, in draw order
+        rect = pygame.Rect(rect)
+        chunk_px = CHUNK_SIZE * self.tile_size
+        margin = self.offgrid_extent()
+
+        entries = []
+        for bx in range((rect.x - margin[0]) // chunk_px, (rect.right - 1) // chunk_px + 1):
+            for by in range((rect.y - margin[1]) // chunk_px, (rect.bottom - 1) // chunk_px + 1):
+                for entry in self.offgrid_index.get((bx, by), ()):
+                    if rect.colliderect(self.offgrid_rect(entry[1])):
+                        entries.append(entry)
+
+        entries.sort(key=lambda entry: entry[0])
+        return [entry[1] for entry in entries]
+
+    def set_tile(self, loc, tile_type, variant):
+        x, y = int(loc[0]), int(loc[1])
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            chunk = TileChunk()
+            self.add_chunk(x >> CHUNK_SHIFT, y >> CHUNK_SHIFT, chunk)
+
+        t_id = self.type_id(tile_type)
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[i] == t_id and chunk.variants[i] == variant:
+            return
+
+        # The new type counts before the dirty rect is measured and the old one after, so it covers both images
+        old_id = chunk.types[i]
+        if old_id == EMPTY:
+            chunk.count += 1
+        if old_id != t_id:
+            self.add_type_count(t_id, 1)
+        chunk.types[i] = t_id
+        chunk.variants[i] = variant
+        chunk.solid[i] = self.solid_types[t_id]
+        self.revision += 1
+        self.mark_tile_dirty(x, y)
+        if old_id != EMPTY and old_id != t_id:
+            self.add_type_count(old_id, -1)
+
+    def remove_tile(self, loc):
+        x, y = int(loc[0]), int(loc[1])
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return False
+
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        old_id = chunk.types[i]
+        if old_id == EMPTY:
+            return False
+
+        chunk.types[i] = EMPTY
+        chunk.variants[i] = 0
+        chunk.solid[i] = 0
+        chunk.count -= 1
+        self.revision += 1
+        if not chunk.count:
+            self.remove_chunk(x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        self.mark_tile_dirty(x, y)
+        self.add_type_count(old_id, -1)
+
+        return True
+
+    def snapshot(self):
+        # A private copy of the map that restore() can bring back
+        return {
+            "revision": self.revision,
+            "tile_size": self.tile_size,
+            "chunks": {loc: chunk.copy() for loc, chunk in self.chunks.items()},
+            "offgrid": [{"type": tile["type"], "variant": tile["variant"], "pos": list(tile["pos"])} for tile in self.offgrid_tiles],
+        }
+
+    def restore(self, snapshot):
+        # Nothing is copied back unless the map changed since the snapshot
+        if self.revision == snapshot["revision"]:
+            return
+
+        self.clear()
+        self.tile_size = snapshot["tile_size"]
+        self.chunks = {loc: chunk.copy() for loc, chunk in snapshot["chunks"].items()}
+        self.count_types()
+        self.index_chunks()
+        for tile in snapshot["offgrid"]:
+            self.add_offgrid({"type": tile["type"], "variant": tile["variant"], "pos": list(tile["pos"])})
+        self.revision = snapshot["revision"]
+
+    def tile_id_at(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return EMPTY
+
+        return chunk.types[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+    def get_tile(self, loc):
+        x, y = int(loc[0]), int(loc[1])
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+        if chunk is None:
+            return None
+
+        i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+        if chunk.types[i] == EMPTY:
+            return None
+
+        return {"type": self.tile_types[chunk.types[i]], "variant": chunk.variants[i], "pos": [x, y]}
+
+    def grid_tiles(self):
+        # Yields (x, y, type_id, variant) for every grid tile
+        for (cx, cy), chunk in list(self.chunks.items()):
+            base_x = cx << CHUNK_SHIFT
+            base_y = cy << CHUNK_SHIFT
+            types = chunk.types
+            for i in range(CHUNK_SIZE * CHUNK_SIZE):
+                if types[i] != EMPTY:
+                    yield base_x + (i & CHUNK_MASK), base_y + (i >> CHUNK_SHIFT), types[i], chunk.variants[i]
+
     def extract(self, id_pairs, keep=False):
         matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-
-        for loc in self.tilemap.copy():
-            tile = self.tilemap[loc]
-            if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]["pos"] = matches[-1]["pos"].copy()
-                matches[-1]["pos"][0] *= self.tile_size
-                matches[-1]["pos"][1] *= self.tile_size
-
-                if not keep:
-                    del self.tilemap[loc]
+        entries = []
+        for id_pair in id_pairs:
+            entries.extend(self.offgrid_types.get(tuple(id_pair), ()))
+
+        entries.sort(key=lambda entry: entry[0])
+        for seq, tile in entries:
+            matches.append(tile.copy())
+        if not keep:
+            self.remove_offgrids([tile for seq, tile in entries])
+
+        # Only chunks holding one of the requested grid type ids are scanned, cell by cell
+        grid_pairs = {(self.type_ids[id_pair[0]], id_pair[1]) for id_pair in id_pairs if id_pair[0] in self.type_ids}
+        grid_ids = {t_id for t_id, variant in grid_pairs}
+        for (cx, cy), chunk in list(self.chunks.items()) if grid_ids else ():
+            types = chunk.types
+            if not any(t_id in types for t_id in grid_ids):
+                continue
+
+            variants = chunk.variants
+            for i in range(CHUNK_SIZE * CHUNK_SIZE):
+                if types[i] in grid_ids and (types[i], variants[i]) in grid_pairs:
+                    x = (cx << CHUNK_SHIFT) + (i & CHUNK_MASK)
+                    y = (cy << CHUNK_SHIFT) + (i >> CHUNK_SHIFT)
+                    matches.append({"type": self.tile_types[types[i]], "variant": variants[i], "pos": [x * self.tile_size, y * self.tile_size]})
+
+                    if not keep:
+                        self.remove_tile((x, y))
 
         return matches
 
@@ -63,90 +455,322 @@ class Tilemap:
 
         tile_loc = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
         for offset in NEIGHBOR_OFFSETS:
-            check_loc = str(tile_loc[0] + offset[0]) + ";" + str(tile_loc[1] + offset[1])
-
-            if check_loc in self.tilemap:
-                tiles.append(self.tilemap[check_loc])
+            tile = self.get_tile((tile_loc[0] + offset[0], tile_loc[1] + offset[1]))
+            if tile:
+                tiles.append(tile)
 
         return tiles
 
-    def phsysics_rects_around(self, pos):
-        rects = []
-        for tile in self.tiles_around(pos):
-            if tile["type"] in PHYSICS_TILES:
-                rects.append(
-                    pygame.Rect(
-                        tile["pos"][0] * self.tile_size,
-                        tile["pos"][1] * self.tile_size,
-                        self.tile_size,
-                        self.tile_size,
-                    )
-                )
+    def solid_runs(self, line, axis):
+        # Solid runs along a row (axis 0) or column (axis 1) as sorted start and end lists in tile units
+        cache = self.solid_cols if axis else self.solid_rows
+        runs = cache.get(line)
+        if runs is None:
+            starts = []
+            ends = []
+            offset = line & CHUNK_MASK
+            chunk_line = line >> CHUNK_SHIFT
+            for pos in (self.chunk_cols if axis else self.chunk_rows).get(chunk_line, ()):
+                solid = self.chunks[(chunk_line, pos) if axis else (pos, chunk_line)].solid
+                cells = solid[offset::CHUNK_SIZE] if axis else solid[offset << CHUNK_SHIFT : (offset + 1) << CHUNK_SHIFT]
+                base = pos << CHUNK_SHIFT
+                # Empty and fully solid stretches skip the per cell loop
+                if 1 not in cells:
+                    continue
+                if 0 not in cells:
+                    if ends and ends[-1] == base:
+                        ends[-1] += CHUNK_SIZE
+                    else:
+                        starts.append(base)
+                        ends.append(base + CHUNK_SIZE)
+                    continue
+
+                for i, is_solid in enumerate(cells):
+                    if is_solid:
+                        if ends and ends[-1] == base + i:
+                            ends[-1] += 1
+                        else:
+                            starts.append(base + i)
+                            ends.append(base + i + 1)
+            runs = (starts, ends)
+            cache[line] = runs
+
+        return runs
+
+    def build_solid_runs(self):
+        # Fills the row run cache for the whole map, so sight line queries never build it mid-game
+        for cy in self.chunk_rows:
+            for row in range(cy << CHUNK_SHIFT, (cy + 1) << CHUNK_SHIFT):
+                self.solid_runs(row, 0)
+
+    def line_clear(self, start, end):
+        # Whether a segment between two pixel positions misses every solid tile, one run lookup per row it crosses
+        ts = self.tile_size
+        (x0, y0), (x1, y1) = sorted((start, end), key=lambda point: point[1])
+        for row in range(math.floor(y0 / ts), math.floor(y1 / ts) + 1):
+            if y1 != y0:
+                xa = x0 + (x1 - x0) * (max(y0, row * ts) - y0) / (y1 - y0)
+                xb = x0 + (x1 - x0) * (min(y1, (row + 1) * ts) - y0) / (y1 - y0)
+            else:
+                xa, xb = x0, x1
+            lo = math.floor(min(xa, xb) / ts)
+            hi = math.floor(max(xa, xb) / ts)
+
+            starts, ends = self.solid_runs(row, 0)
+            i = bisect_right(ends, lo)
+            if i < len(starts) and starts[i] <= hi:
+                return False
+
+        return True
+
+    def sweep(self, pos, size, delta, axis):
+        # Moves a box delta pixels along one axis, stopping at the first solid edge it touches or passes through
+        # Returns the new position on that axis and whether it hit anything
+        ts = self.tile_size
+        cross = int(pos[1 - axis])
+        start = int(pos[axis])
+        end = int(pos[axis] + delta)
 
-        return rects
+        if delta > 0:
+            lo = min(start + size[axis], end)
+            hi = end + size[axis]
+            edge = None
+            for line in range(cross // ts, (cross + size[1 - axis] - 1) // ts + 1):
+                starts, ends = self.solid_runs(line, axis)
+                i = bisect_right(ends, lo // ts)
+                if i < len(starts) and starts[i] * ts < hi:
+                    hit = max(starts[i], lo // ts) * ts
+                    if edge is None or hit < edge:
+                        edge = hit
+            if edge is not None:
+                return edge - size[axis], True
+        else:
+            lo = end
+            hi = max(start, end + size[axis])
+            edge = None
+            for line in range(cross // ts, (cross + size[1 - axis] - 1) // ts + 1):
+                starts, ends = self.solid_runs(line, axis)
+                i = bisect_left(starts, -(-hi // ts)) - 1
+                if i >= 0 and ends[i] * ts > lo:
+                    hit = min(ends[i], -(-hi // ts)) * ts
+                    if edge is None or hit > edge:
+                        edge = hit
+            if edge is not None:
+                return edge, True
+
+        return pos[axis] + delta, False
 
     def solid_check(self, pos):
-        tile_loc = str(int(pos[0] // self.tile_size)) + ";" + str(int(pos[1] // self.tile_size))
+        x = int(pos[0] // self.tile_size)
+        y = int(pos[1] // self.tile_size)
+        chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
 
-        if tile_loc in self.tilemap and self.tilemap[tile_loc]["type"] in PHYSICS_TILES:
+        if chunk is not None and chunk.solid[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]:
             return True
 
+    def solid_points(self, xs, ys):
+        # solid_check for many pixel positions at once, one flag per point
+        ts = self.tile_size
+        chunks = self.chunks
+        flags = bytearray(len(xs))
+        last_loc = None
+        chunk = None
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            x = int(x // ts)
+            y = int(y // ts)
+            loc = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+            if loc != last_loc:
+                chunk = chunks.get(loc)
+                last_loc = loc
+            if chunk is not None:
+                flags[i] = chunk.solid[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)]
+
+        return flags
+
     def auto_tile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            if tile["type"] not in AUTOTILE_TYPES:
+        autotile_ids = {self.type_ids[t] for t in AUTOTILE_TYPES if t in self.type_ids}
+
+        for x, y, t_id, variant in self.grid_tiles():
+            if t_id not in autotile_ids:
                 continue
 
             neighbors = set()
             for shift in [(1, 0), (-1, 0), (0, -1), (0, 1)]:
-                check_loc = str(tile["pos"][0] + shift[0]) + ";" + str(tile["pos"][1] + shift[1])
-                if check_loc in self.tilemap and self.tilemap[check_loc]["type"] == tile["type"]:
+                if self.tile_id_at(x + shift[0], y + shift[1]) == t_id:
                     neighbors.add(shift)
 
             neighbors = tuple(sorted(neighbors))
             if neighbors in AUTOTILE_MAP:
-                tile["variant"] = AUTOTILE_MAP[neighbors]
+                self.set_tile((x, y), self.tile_types[t_id], AUTOTILE_MAP[neighbors])
 
     def save(self, path):
+        if path.endswith(COMPILED_EXTENSION):
+            return self.save_compiled(path)
+
+        tilemap = {}
+        for x, y, t_id, variant in self.grid_tiles():
+            tilemap[str(x) + ";" + str(y)] = {"type": self.tile_types[t_id], "variant": variant, "pos": [x, y]}
+
         with open(path, "w") as f:
             f.write(
                 json.dumps(
                     {
-                        "tilemap": self.tilemap,
+                        "tilemap": tilemap,
                         "tile_size": self.tile_size,
                         "offgrid": self.offgrid_tiles,
                     }
                 )
             )
 
-    def load(self, path):
-        map_data = json.load(open(path, "r"))
-        self.tilemap = map_data["tilemap"]
+    def load(self, path, map_data=None):
+        # map_data skips reading a JSON map that was already parsed
+        if path.endswith(COMPILED_EXTENSION):
+            return self.load_compiled(path)
+
+        if map_data is None:
+            map_data = load_map_data(path)
+        self.clear()
         self.tile_size = map_data["tile_size"]
-        self.offgrid_tiles = map_data["offgrid"]
+        for tile in map_data["tilemap"].values():
+            self.set_tile(tile["pos"], tile["type"], tile["variant"])
+        for tile in map_data["offgrid"]:
+            self.add_offgrid(tile)
 
-    def render(self, surf, offset=(0, 0)):
+    def save_compiled(self, path):
+        # Offgrid only types are named in the file but never interned as grid types
+        file_types = list(self.tile_types)
+        file_ids = dict(self.type_ids)
+
+        offgrid = []
+        spawners = []
         for tile in self.offgrid_tiles:
-            surf.blit(
-                self.game.assets[tile["type"]][tile["variant"]],
-                (tile["pos"][0] - offset[0], tile["pos"][1] - offset[1]),
+            if tile["type"] not in file_ids:
+                file_ids[tile["type"]] = len(file_types)
+                file_types.append(tile["type"])
+
+            record = OFFGRID_RECORD.pack(tile["pos"][0], tile["pos"][1], file_ids[tile["type"]], tile["variant"])
+            if tile["type"] == SPAWNER_TYPE:
+                spawners.append(record)
+            else:
+                offgrid.append(record)
+
+        data = [
+            MAP_HEADER.pack(
+                MAP_MAGIC, MAP_VERSION, self.tile_size, len(self.tile_types), len(file_types), len(self.chunks), len(offgrid), len(spawners)
             )
+        ]
+        for tile_type in file_types:
+            name = tile_type.encode("utf-8")
+            data.append(bytes([len(name)]) + name)
+        for (cx, cy), chunk in self.chunks.items():
+            data.append(CHUNK_HEADER.pack(cx, cy, chunk.count))
+            data.append(chunk.types.tobytes())
+            data.append(chunk.variants.tobytes())
+        data.extend(offgrid)
+        data.extend(spawners)
+
+        with open(path, "wb") as f:
+            f.write(b"".join(data))
+
+    def load_compiled(self, path):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, tile_size, grid_type_count, type_count, chunk_count, offgrid_count, spawner_count = MAP_HEADER.unpack_from(data, 0)
+            if magic != MAP_MAGIC or version != MAP_VERSION:
+                raise ValueError(path + " is not a version " + str(MAP_VERSION) + " compiled map")
+            if grid_type_count > min(type_count, MAX_TILE_TYPES):
+                raise ValueError(path + " names " + str(grid_type_count) + " grid tile types, at most " + str(MAX_TILE_TYPES) + " fit in a chunk")
+
+            self.clear()
+            self.tile_size = tile_size
 
-        x_range_start = offset[0] // self.tile_size
-        x_range_end = (offset[0] + surf.get_width()) // self.tile_size + 1
-        y_range_start = offset[1] // self.tile_size
-        y_range_end = (offset[1] + surf.get_height()) // self.tile_size + 1
+            # Map the file's type ids onto ours, so whole chunks can be copied with translate()
+            file_types = []
+            remap = bytearray(range(256))
+            i = MAP_HEADER.size
+            for t in range(type_count):
+                file_types.append(data[i + 1 : i + 1 + data[i]].decode("utf-8"))
+                if t < grid_type_count:
+                    remap[t] = self.type_id(file_types[-1])
+                i += 1 + data[i]
+            solid = bytearray(256)
+            for t_id, is_solid in enumerate(self.solid_types):
+                solid[t_id] = is_solid
 
-        for x in range(x_range_start, x_range_end):
-            for y in range(y_range_start, y_range_end):
-                loc = str(x) + ";" + str(y)
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
+            cell_count = CHUNK_SIZE * CHUNK_SIZE
+            for c in range(chunk_count):
+                cx, cy, count = CHUNK_HEADER.unpack_from(data, i)
+                i += CHUNK_HEADER.size
 
-                    surf.blit(
-                        self.game.assets[tile["type"]][tile["variant"]],
+                chunk = TileChunk()
+                types = data[i : i + cell_count].translate(remap)
+                chunk.types = array("B", types)
+                chunk.variants = array("B", data[i + cell_count : i + 2 * cell_count])
+                chunk.solid = bytearray(types.translate(solid))
+                chunk.count = count
+                self.chunks[(cx, cy)] = chunk
+                i += 2 * cell_count
+            self.count_types()
+            self.index_chunks()
+
+            for record in struct.iter_unpack(OFFGRID_RECORD.format, data[i : i + (offgrid_count + spawner_count) * OFFGRID_RECORD.size]):
+                self.add_offgrid({"type": file_types[record[2]], "variant": record[3], "pos": [record[0], record[1]]})
+
+    def bake_chunk(self, cx, cy):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        origin = (cx * chunk_px, cy * chunk_px)
+        area = pygame.Rect(origin[0], origin[1], chunk_px, chunk_px)
+
+        blits = []
+        for tile in self.offgrid_in_rect(area):
+            tile_r = self.offgrid_rect(tile)
+            blits.append((self.game.assets[tile["type"]][tile["variant"]], (tile_r.x - origin[0], tile_r.y - origin[1])))
+
+        # Grid tiles just above and left of the chunk can reach into it
+        overhang = self.grid_overhang()
+        for x in range((cx << CHUNK_SHIFT) - overhang[0], (cx + 1) << CHUNK_SHIFT):
+            for y in range((cy << CHUNK_SHIFT) - overhang[1], (cy + 1) << CHUNK_SHIFT):
+                chunk = self.chunks.get((x >> CHUNK_SHIFT, y >> CHUNK_SHIFT))
+                if chunk is None:
+                    continue
+
+                i = ((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)
+                if chunk.types[i] != EMPTY:
+                    blits.append(
                         (
-                            tile["pos"][0] * self.tile_size - offset[0],
-                            tile["pos"][1] * self.tile_size - offset[1],
-                        ),
+                            self.game.assets[self.tile_types[chunk.types[i]]][chunk.variants[i]],
+                            (x * self.tile_size - origin[0], y * self.tile_size - origin[1]),
+                        )
                     )
+
+        if not blits:
+            return None
+
+        surf = pygame.Surface((chunk_px, chunk_px))
+        surf.set_colorkey((0, 0, 0))
+        surf.blits(blits, doreturn=False)
+        return surf
+
+    def render(self, surf, offset=(0, 0)):
+        chunk_px = CHUNK_SIZE * self.tile_size
+        x_range_start = offset[0] // chunk_px
+        x_range_end = (offset[0] + surf.get_width()) // chunk_px + 1
+        y_range_start = offset[1] // chunk_px
+        y_range_end = (offset[1] + surf.get_height()) // chunk_px + 1
+
+        blits = []
+        for cx in range(x_range_start, x_range_end):
+            for cy in range(y_range_start, y_range_end):
+                if (cx, cy) in self.chunk_surfaces:
+                    # Move to the back of the LRU order
+                    chunk_surf = self.chunk_surfaces.pop((cx, cy))
+                else:
+                    chunk_surf = self.bake_chunk(cx, cy)
+                self.chunk_surfaces[(cx, cy)] = chunk_surf
+
+                if chunk_surf:
+                    blits.append((chunk_surf, (cx * chunk_px - offset[0], cy * chunk_px - offset[1])))
+
+        while len(self.chunk_surfaces) > CHUNK_CACHE_SIZE:
+            del self.chunk_surfaces[next(iter(self.chunk_surfaces))]
+
+        surf.blits(blits, doreturn=False)